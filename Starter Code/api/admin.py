@@ -1,5 +1,5 @@
 from django.contrib import admin
-from api.models import Order, OrderItem, User, Product
+from api.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, User, Product
 # Register your models here.
 
 
@@ -33,3 +33,15 @@ admin.site.register(User)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ("name", "price", "stock")
     search_fields = ("name", )
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    #a separate changelist, so the live Order changelist only pages through live orders
+    inlines = [ArchivedOrderItemInline]
+    list_display = ("order_id", "user", "status", "created_at", "archived_at")
+    list_filter = ("status", )
@@ -6,4 +6,11 @@ class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self):
+        from django.conf import settings
+        from django.core.signals import request_started
+
         from . import signals
+        from .warmup import warm_on_first_request
+
+        if settings.WARM_CACHE_ON_STARTUP:
+            request_started.connect(warm_on_first_request)
@@ -0,0 +1,84 @@
+"""
+Keeps the live Order/OrderItem tables small by moving old, finished orders into
+ArchivedOrder/ArchivedOrderItem:
+
+    python manage.py archive_orders --days 90
+
+Every batch is its own transaction: copy the orders and their items, then delete them
+from the live tables. An order is therefore always in exactly one of the two places,
+and OrderViewSet.retrieve falls back to the archive when it is not live anymore.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.cache import one_bump_on_commit
+from api.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from api.routers import on_primary
+
+#Pending orders can still change, they are never archived
+ARCHIVABLE_STATUSES = (Order.StatusChoices.CONFIRMED,
+                       Order.StatusChoices.CANCELED)
+
+
+def archivable_orders(cutoff):
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES,
+                                created_at__lt=cutoff).order_by('created_at')
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Moves up to batch_size orders created before cutoff, returns how many were moved.
+    """
+    with transaction.atomic():
+        #locked until the batch commits, so nobody changes what is copied before it is deleted
+        orders = list(
+            archivable_orders(cutoff).select_for_update().values(
+                'order_id', 'user_id', 'created_at', 'status')[:batch_size])
+        if not orders:
+            return 0
+        ids = [order['order_id'] for order in orders]
+        items = OrderItem.objects.filter(order_id__in=ids).select_for_update()
+
+        ArchivedOrder.objects.bulk_create(
+            [ArchivedOrder(**order) for order in orders])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(**item)
+            for item in items.values('order_id', 'product_id', 'quantity',
+                                     'unit_price', 'product_name')
+        ])
+        #the same conditions again: an order that is not archivable anymore stays live
+        #(the items go with their order). delete() sends post_delete for every order and item,
+        #each would invalidate the order lists: one invalidation once the batch is committed
+        with one_bump_on_commit('order_list'):
+            Order.objects.filter(pk__in=ids,
+                                 status__in=ARCHIVABLE_STATUSES,
+                                 created_at__lt=cutoff).delete()
+        kept = list(
+            Order.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if kept:
+            #never in both places: drop the copies of the orders that stayed
+            ArchivedOrder.objects.filter(pk__in=kept).delete()
+    return len(orders) - len(kept)
+
+
+def archive_orders(days, batch_size, max_batches=None, on_batch=None):
+    """
+    Archives Confirmed/Canceled orders older than `days`, batch by batch, until none are left
+    (or max_batches were done). on_batch(moved) is called after every batch.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    total = 0
+    batches = 0
+    #the copy has to read what it is about to delete from the primary, never from a lagging replica
+    with on_primary():
+        while max_batches is None or batches < max_batches:
+            moved = archive_batch(cutoff, batch_size)
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            if on_batch is not None:
+                on_batch(moved)
+    return total
@@ -0,0 +1,263 @@
+"""
+Response caching for the list views, with protection against cache stampedes.
+
+Instead of deleting cache entries, invalidation bumps a generation number per key prefix
+(see bump_generation). Entries from an older generation are stale: one worker rebuilds
+them while every other worker keeps serving the stale copy.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from api.compression import compressed_variants, negotiate
+from api.warmup import flush_requests, record_request
+
+#prefixes whose bumps are folded into one on commit, per thread (see one_bump_on_commit)
+_deferred = threading.local()
+
+
+def generation_key(prefix):
+    return f'{prefix}:generation'
+
+
+def get_generation(prefix):
+    return cache.get_or_set(generation_key(prefix), 1, None)
+
+
+def bump_generation(prefix):
+    """
+    Marks every cached entry under this prefix as stale, in one atomic increment.
+    """
+    if prefix in getattr(_deferred, 'prefixes', ()):
+        return
+    key = generation_key(prefix)
+    try:
+        cache.incr(key)
+    except ValueError:
+        #the key was evicted or never set: start a new generation
+        cache.add(key, 1, None)
+        cache.incr(key)
+
+
+def product_cache_key(pk):
+    """
+    One serialized product, used by /products/batch and deleted by the product signals.
+    """
+    return f'product:{pk}'
+
+
+def _is_fresh(entry, generation, beta):
+    """
+    Probabilistic early expiration (XFetch): the closer we get to the soft expiry,
+    and the longer the value took to build, the likelier a single request decides to rebuild early.
+    beta=0 turns early expiration off.
+    """
+    if entry['generation'] != generation:
+        return False
+    early = -entry['delta'] * beta * math.log(1 - random.random())
+    return time.time() + early < entry['expires']
+
+
+def _get_shared(key):
+    #TieredCache: past this process' local copy, which may predate another process' rebuild
+    return getattr(cache, 'get_shared', cache.get)(key)
+
+
+@contextmanager
+def one_bump_on_commit(prefix):
+    """
+    The bump_generation(prefix) calls of the block (the post_delete signal of every deleted row,
+    say) are skipped, the block bumps once after its transaction commits instead.
+    """
+    outer = getattr(_deferred, 'prefixes', frozenset())
+    _deferred.prefixes = outer | {prefix}
+    try:
+        yield
+    finally:
+        _deferred.prefixes = outer
+    transaction.on_commit(lambda: bump_generation(prefix))
+
+
+class Uncacheable(Exception):
+    """
+    Raised by a rebuild whose result must not be cached, carries the result to return instead.
+    """
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+
+def get_or_rebuild(key,
+                   rebuild,
+                   timeout,
+                   generation=None,
+                   stale_timeout=60,
+                   lock_timeout=10,
+                   wait_timeout=1,
+                   beta=1.0):
+    """
+    Return the cached value for key, calling rebuild() at most once at a time per key.
+
+    timeout        -> seconds the value is considered fresh
+    stale_timeout  -> extra seconds a stale value may still be served while it is rebuilt
+    lock_timeout   -> how long a rebuild may hold the lock before someone else takes over
+    wait_timeout   -> how long a request with nothing to serve waits for that rebuild
+                      before it builds the value itself
+
+    rebuild() may raise Uncacheable, nothing is stored then and the exception propagates.
+    """
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry, generation, beta):
+        return entry['value']
+    if entry is not None and not _is_fresh(entry, generation, 0):
+        #the local copy is stale, another process may have rebuilt it already
+        entry = _get_shared(key)
+        if entry is not None and _is_fresh(entry, generation, beta):
+            return entry['value']
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            #somebody may have finished a rebuild between our get() and add()
+            entry = _get_shared(key)
+            if entry is not None and _is_fresh(entry, generation, 0):
+                return entry['value']
+            return _rebuild(key, rebuild, timeout, generation, stale_timeout)
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        #another worker is rebuilding, serve what we have meanwhile
+        return entry['value']
+
+    #nothing to serve at all: wait a little for the worker holding the lock
+    deadline = time.time() + min(wait_timeout, lock_timeout)
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = _get_shared(key)
+        if entry is not None and _is_fresh(entry, generation, 0):
+            return entry['value']
+    #the lock holder died or is too slow, don't spend the request waiting for it
+    return _rebuild(key, rebuild, timeout, generation, stale_timeout)
+
+
+def _rebuild(key, rebuild, timeout, generation, stale_timeout):
+    started = time.time()
+    value = rebuild()
+    finished = time.time()
+    cache.set(
+        key, {
+            'value': value,
+            'generation': generation,
+            'expires': finished + timeout,
+            'delta': finished - started,
+        }, timeout + stale_timeout)
+    return value
+
+
+def _sorted_names(values):
+    names = {name.strip() for value in values for name in value.split(',')}
+    return [','.join(sorted(names - {''}))]
+
+
+def response_cache_key(prefix, request, per_user=False):
+    """
+    One key per path + query string + rendered format (+ user for per-user lists).
+    Query parameters are sorted so ?a=1&b=2 and ?b=2&a=1 share the entry,
+    and so are the names in ?fields= / ?exclude= (?fields=price,name == ?fields=name,price).
+    """
+    query = []
+    for param, values in sorted(request.query_params.lists()):
+        if param in ('fields', 'exclude'):
+            values = _sorted_names(values)
+        query.append((param, values))
+    parts = [request.path, repr(query), request.accepted_renderer.format]
+    if per_user:
+        parts.append(str(request.user.pk))
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return f'{prefix}:{digest}'
+
+
+#describe the stored body, set again for the variant that is served
+FRAMING_HEADERS = ('content-type', 'content-length', 'content-encoding')
+
+
+def cached_view(prefix, timeout, per_user=False, **options):
+    """
+    Method decorator for a view's list() that caches the rendered response.
+    Can replace method_decorator(cache_page(...)) on any DRF view in api/views.py;
+    invalidate with bump_generation(prefix).
+    Compressed variants are built with the entry, hits never compress again.
+    """
+
+    def decorator(view_method):
+
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+
+            def rebuild():
+                #a miss runs the view anyway, the recorded requests are written along with it
+                flush_requests(prefix)
+                response = view_method(self, request, *args, **kwargs)
+                response = self.finalize_response(request, response, *args,
+                                                  **kwargs)
+                response.render()
+                if response.status_code != 200:
+                    #errors, pages past the end, redirects: only successes are replayed
+                    raise Uncacheable(response)
+                return {
+                    'content':
+                    response.content,
+                    'status':
+                    response.status_code,
+                    'content_type':
+                    response['Content-Type'],
+                    #Vary, Allow, Link, ... (the body's framing is rebuilt on replay)
+                    'headers': [(name, value)
+                                for name, value in response.items()
+                                if name.lower() not in FRAMING_HEADERS],
+                    'variants':
+                    compressed_variants(response.content,
+                                        response['Content-Type']),
+                }
+
+            if not per_user:
+                #what `manage.py warm_cache` replays after a deploy
+                record_request(prefix, request)
+            key = response_cache_key(prefix, request, per_user)
+            try:
+                cached = get_or_rebuild(key,
+                                        rebuild,
+                                        timeout,
+                                        generation=get_generation(prefix),
+                                        **options)
+            except Uncacheable as uncached:
+                return uncached.value
+            #entries cached before variants existed have none
+            variants = cached.get('variants', {})
+            coding = negotiate(request.headers.get('Accept-Encoding', ''),
+                               variants)
+            response = HttpResponse(variants.get(coding, cached['content']),
+                                    status=cached['status'],
+                                    content_type=cached['content_type'])
+            for name, value in cached.get('headers', ()):
+                response[name] = value
+            if variants:
+                patch_vary_headers(response, ('Accept-Encoding', ))
+            if coding is not None:
+                response['Content-Encoding'] = coding
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,316 @@
+"""
+Two-tier cache backend: a small in-process LRU in front of the shared cache (Redis).
+
+A hit in the local tier costs no network round trip and no unpickling.
+Invalidations (incr/decr/delete, which is what api.cache.bump_generation uses) bump a shared
+epoch number and record which key changed under it. Every process compares its epoch with the
+shared one at most once per EPOCH_CHECK_INTERVAL and drops just the keys invalidated since;
+only when it fell too far behind (or after clear()) it drops its whole local tier.
+A plain set() from another process is only seen here once the local entry times out (LOCAL_TIMEOUT),
+get_shared() reads past the local tier for callers that cannot wait that long.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'api.cache_backends.TieredCache',
+        'LOCATION': 'tiered',
+        'OPTIONS': {'SHARED_ALIAS': 'shared', 'LOCAL_MAX_ENTRIES': 1000, 'LOCAL_TIMEOUT': 5},
+    },
+    'shared': {'BACKEND': 'django_redis.cache.RedisCache', ...},
+}
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+EPOCH_KEY = 'tiered:epoch'
+#the keys invalidated under one epoch number, None for "everything" (clear())
+INVALIDATED_KEY = 'tiered:invalidated:{}'
+#a process further behind than this drops its whole local tier instead of catching up key by key
+MAX_INVALIDATIONS_BEHIND = 100
+STATS_KEY = 'tiered:stats:{}'
+TIERS = ('local', 'shared', 'miss')
+
+#Django creates one backend instance per thread, the local tier is shared by all threads of the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class _LocalStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.epoch = None
+        self.checked_at = 0
+        self.counts = dict.fromkeys(TIERS, 0)
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self._max_local_entries = options.get('LOCAL_MAX_ENTRIES', 1000)
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._epoch_check_interval = options.get('EPOCH_CHECK_INTERVAL', 1)
+        #keys with these suffixes are coordination keys (locks, counters) and always go to the
+        #shared tier, incrementing them does not invalidate anything
+        self._shared_only_suffixes = tuple(
+            options.get('SHARED_ONLY_SUFFIXES', (':lock', ':count')))
+        with _stores_lock:
+            self._store = _stores.setdefault(location, _LocalStore())
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_key(self, key, version):
+        return self.make_key(key, version)
+
+    def _is_shared_only(self, key):
+        return key.endswith(self._shared_only_suffixes)
+
+    # local tier
+
+    def _sync(self):
+        """
+        Drop the local keys other processes invalidated since the last sync,
+        and push this process' hit counters to the shared tier.
+        """
+        store = self._store
+        now = time.monotonic()
+        if now - store.checked_at < self._epoch_check_interval:
+            return
+        store.checked_at = now
+        epoch = self.shared.get(EPOCH_KEY, 0)
+        known = store.epoch
+        stale = set()
+        if known is not None and epoch != known:
+            stale = self._invalidated_between(known, epoch)
+        with store.lock:
+            if stale is None:
+                store.entries.clear()
+            else:
+                for key in stale:
+                    store.entries.pop(key, None)
+            store.epoch = epoch
+            counts, store.counts = store.counts, dict.fromkeys(TIERS, 0)
+        for tier, count in counts.items():
+            if count:
+                self._incr_shared(STATS_KEY.format(tier), count)
+
+    def _invalidated_between(self, known, epoch):
+        """
+        The local keys invalidated after epoch `known` up to `epoch`, None if that is not known
+        (too far behind, a record expired, the shared tier was flushed, or clear() was called).
+        """
+        if not known < epoch <= known + MAX_INVALIDATIONS_BEHIND:
+            return None
+        names = [
+            INVALIDATED_KEY.format(n) for n in range(known + 1, epoch + 1)
+        ]
+        records = self.shared.get_many(names)
+        if len(records) < len(names):
+            return None
+        stale = set()
+        for keys in records.values():
+            if keys is None:
+                return None
+            stale.update(keys)
+        return stale
+
+    def _local_get(self, key):
+        store = self._store
+        with store.lock:
+            entry = store.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del store.entries[key]
+                return False, None
+            store.entries.move_to_end(key)
+            return True, entry[1]
+
+    def _local_set(self, key, value, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        local_timeout = self._local_timeout
+        if timeout is not None:
+            local_timeout = min(local_timeout, timeout - time.time())
+        if local_timeout <= 0:
+            return
+        store = self._store
+        with store.lock:
+            store.entries[key] = (time.monotonic() + local_timeout, value)
+            store.entries.move_to_end(key)
+            while len(store.entries) > self._max_local_entries:
+                store.entries.popitem(last=False)
+
+    def _local_delete(self, key):
+        with self._store.lock:
+            self._store.entries.pop(key, None)
+
+    def _count(self, tier, amount=1):
+        with self._store.lock:
+            self._store.counts[tier] += amount
+
+    def _incr_shared(self, key, delta=1):
+        try:
+            return self.shared.incr(key, delta)
+        except ValueError:
+            self.shared.add(key, 0, None)
+            return self.shared.incr(key, delta)
+
+    def _invalidate(self, local_keys=None):
+        """
+        Tell the other processes to drop these local keys (None: their whole local tier).
+        The caller already dropped its own copies, the next _sync() catches up with the rest.
+        """
+        epoch = self._incr_shared(EPOCH_KEY)
+        #outlives any sensible EPOCH_CHECK_INTERVAL, an idle process that missed it clears everything
+        self.shared.set(INVALIDATED_KEY.format(epoch), local_keys,
+                        max(60, self._local_timeout * 10))
+
+    # cache API
+
+    def get(self, key, default=None, version=None):
+        if self._is_shared_only(key):
+            return self.shared.get(key, default, version)
+        self._sync()
+        local_key = self._local_key(key, version)
+        found, value = self._local_get(local_key)
+        if found:
+            self._count('local')
+            return value
+        missing = object()
+        value = self.shared.get(key, missing, version)
+        if value is missing:
+            self._count('miss')
+            return default
+        self._count('shared')
+        self._local_set(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_shared(self, key, default=None, version=None):
+        """
+        Reads the shared tier even if the local tier has the key, and refreshes the local copy.
+        For re-checks that must see what another process just wrote (see api.cache.get_or_rebuild).
+        """
+        missing = object()
+        value = self.shared.get(key, missing, version)
+        if self._is_shared_only(key):
+            return default if value is missing else value
+        local_key = self._local_key(key, version)
+        if value is missing:
+            self._local_delete(local_key)
+            return default
+        self._local_set(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        if not self._is_shared_only(key):
+            self._local_set(self._local_key(key, version), value, timeout)
+
+    def get_many(self, keys, version=None):
+        #everything the local tier does not have is fetched in one round trip
+        self._sync()
+        found = {}
+        remote = []
+        for key in keys:
+            if self._is_shared_only(key):
+                remote.append(key)
+                continue
+            hit, value = self._local_get(self._local_key(key, version))
+            if hit:
+                found[key] = value
+            else:
+                remote.append(key)
+        self._count('local', len(found))
+        if remote:
+            fetched = self.shared.get_many(remote, version)
+            for key, value in fetched.items():
+                if not self._is_shared_only(key):
+                    self._local_set(self._local_key(key, version), value,
+                                    DEFAULT_TIMEOUT)
+            found.update(fetched)
+            self._count('shared', len(fetched))
+            self._count('miss', len(remote) - len(fetched))
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        #django_redis returns None instead of the list of failed keys
+        failed = self.shared.set_many(data, timeout, version) or []
+        for key, value in data.items():
+            if not self._is_shared_only(key) and key not in failed:
+                self._local_set(self._local_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        #add() has to be atomic across processes, only the shared tier can decide
+        return self.shared.add(key, value, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        deleted = self.shared.delete(key, version)
+        if not self._is_shared_only(key):
+            local_key = self._local_key(key, version)
+            self._local_delete(local_key)
+            self._invalidate([local_key])
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        if not self._is_shared_only(key):
+            local_key = self._local_key(key, version)
+            self._local_delete(local_key)
+            self._invalidate([local_key])
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, version=version) is not None
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version)
+        local_keys = [
+            self._local_key(key, version) for key in keys
+            if not self._is_shared_only(key)
+        ]
+        for local_key in local_keys:
+            self._local_delete(local_key)
+        if local_keys:
+            self._invalidate(local_keys)
+
+    def clear(self):
+        #the epoch must keep counting up, a process that knew it would miss a restart at 1
+        epoch = self.shared.get(EPOCH_KEY, 0)
+        self.shared.clear()
+        self.shared.add(EPOCH_KEY, epoch, None)
+        with self._store.lock:
+            self._store.entries.clear()
+        self._invalidate()
+
+    def stats(self):
+        """
+        Hit ratios per tier across all processes (as of their last sync).
+        """
+        counts = {
+            tier: self.shared.get(STATS_KEY.format(tier), 0)
+            for tier in TIERS
+        }
+        total = sum(counts.values())
+        return {
+            tier: {
+                'count': count,
+                'ratio': count / total if total else 0.0
+            }
+            for tier, count in counts.items()
+        }
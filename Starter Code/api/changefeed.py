@@ -0,0 +1,59 @@
+"""
+Incremental product sync for downstream services.
+
+Every product save and delete appends a ProductChange (see api/signals.py). A client keeps the
+token of the last change it has seen and only asks for what happened after it:
+
+    GET /products/changes?since=0         -> the whole catalog, page by page
+    GET /products/changes?since=<next>    -> only what changed since then
+
+A product shows up at most once per page, with its latest state (compaction), so a sync costs
+O(changed products) instead of O(catalog).
+Writes that bypass the model signals (QuerySet.update(), bulk_create()) are not logged.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import ProductChange
+
+
+def record_change(product_id, action):
+    ProductChange.objects.create(product_id=product_id, action=action)
+
+
+def latest_changes(queryset):
+    """
+    The id of the newest change of every product in queryset.
+    """
+    return queryset.values('product_id').annotate(last=Max('pk')).values_list(
+        'last', flat=True)
+
+
+def changes_since(since, limit):
+    """
+    The latest change of every product changed after token `since`, oldest first.
+    Returns (changes, has_more).
+    """
+    #a change that is only a moment old may belong to a transaction that has not committed yet
+    #while a later one already has, handing out a token past it would skip it for good
+    settled = timezone.now() - timedelta(
+        seconds=settings.PRODUCT_CHANGES_SETTLE_SECONDS)
+    pending = ProductChange.objects.filter(pk__gt=since,
+                                           changed_at__lte=settled)
+    ids = list(latest_changes(pending).order_by('last')[:limit + 1])
+    page = ids[:limit]
+    changes = ProductChange.objects.in_bulk(page)
+    return [changes[pk] for pk in page], len(ids) > limit
+
+
+def compact_log():
+    """
+    Deletes every change that a newer change of the same product supersedes.
+    changes_since() returns the same for every token before and after, the log just gets smaller.
+    """
+    latest = latest_changes(ProductChange.objects.all())
+    deleted, _ = ProductChange.objects.exclude(pk__in=latest).delete()
+    return deleted
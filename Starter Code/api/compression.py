@@ -0,0 +1,155 @@
+"""
+Content-negotiated response compression: zstd, Brotli or gzip, whichever the client accepts
+and this process can produce (brotli and zstandard are optional packages, gzip always works).
+
+Bodies smaller than COMPRESSION_MIN_SIZE are sent as they are, the headers would eat the gain.
+cached_view (api/cache.py) stores compressed variants next to the cached body, so cache hits
+are served precompressed and CompressionMiddleware leaves them alone.
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/vnd.oai.openapi',
+                      'text/')
+_ACCEPT_ENCODING = re.compile(r'\s*([\w*]+)\s*(?:;\s*q\s*=\s*([\d.]+))?')
+
+#per request the body is compressed while the client waits, cached variants once per rebuild.
+#That rebuild still runs inside the request holding the single-flight lock (api/cache.py),
+#so the cached levels stay moderate: the maximum ones (br 11, zstd 19) can take seconds on a large
+#list for a few percent of size.
+LEVELS = {
+    'zstd': {
+        'dynamic': 3,
+        'cached': 6
+    },
+    'br': {
+        'dynamic': 4,
+        'cached': 5
+    },
+    'gzip': {
+        'dynamic': 6,
+        'cached': 6
+    },
+}
+
+
+def available_codings():
+    """
+    The codings this process can produce, preferred first.
+    """
+    codings = []
+    if zstandard is not None:
+        codings.append('zstd')
+    if brotli is not None:
+        codings.append('br')
+    codings.append('gzip')
+    return codings
+
+
+def compress(body, coding, mode='dynamic'):
+    level = LEVELS[coding][mode]
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if coding == 'br':
+        return brotli.compress(body, quality=level)
+    #mtime=0: the same body always compresses to the same bytes
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def negotiate(accept_encoding, codings=None):
+    """
+    'gzip, br;q=0.8'  ->  'gzip'
+    The coding with the highest q-value among `codings`, our preference order breaks ties.
+    None when the client accepts none of them.
+    """
+    if codings is None:
+        codings = available_codings()
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = _ACCEPT_ENCODING.match(part)
+        if not match or not match[1]:
+            continue
+        try:
+            weights[match[1].lower()] = float(match[2] or 1)
+        except ValueError:
+            continue
+    best, best_weight = None, 0
+    for coding in codings:
+        weight = weights.get(coding, weights.get('*', 0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def is_compressible(content_type, size):
+    return size >= settings.COMPRESSION_MIN_SIZE and content_type.startswith(
+        COMPRESSIBLE_TYPES)
+
+
+def compressed_variants(body, content_type):
+    """
+    {coding: compressed body} for every available coding, for cache entries.
+    Empty when the body is too small or not worth compressing.
+    """
+    if not is_compressible(content_type, len(body)):
+        return {}
+    variants = {}
+    for coding in available_codings():
+        compressed = compress(body, coding, 'cached')
+        if len(compressed) < len(body):
+            variants[coding] = compressed
+    return variants
+
+
+def weaken_etag(response):
+    #the compressed body is not byte-identical to the one the strong ETag was computed for
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses for clients that send Accept-Encoding, like Django's GZipMiddleware
+    but with zstd/Brotli and a size threshold. Responses that already have a Content-Encoding
+    (precompressed cache hits, the OpenAPI schema) are passed through.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        if not is_compressible(response.get('Content-Type', ''),
+                               len(response.content)):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        coding = negotiate(request.headers.get('Accept-Encoding', ''))
+        if coding is None:
+            return response
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        weaken_etag(response)
+        return response
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+class IdempotentCreateMixin:
+    """
+    Makes create() safe to retry: a client sends the same Idempotency-Key header on every retry,
+    the first request is processed and its response stored (per user + key),
+    every retry gets the stored response back without running create() again.
+
+    While the first request is still running, duplicates wait up to IDEMPOTENCY_WAIT seconds
+    for its response and are rejected with 409 if it is not ready by then.
+    """
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'detail': f'{IDEMPOTENCY_HEADER} is too long.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        cache_key = f'idempotency:{request.user.pk}:{digest}'
+        fingerprint = hashlib.sha256(
+            json.dumps(request.data, sort_keys=True,
+                       default=str).encode()).hexdigest()
+
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return self.replay(stored, fingerprint)
+
+        lock_key = f'{cache_key}:lock'
+        if not cache.add(lock_key, 1, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            #the first request with this key is still running
+            stored = self.wait_for_response(cache_key)
+            if stored is not None:
+                return self.replay(stored, fingerprint)
+            return Response(
+                {
+                    'detail':
+                    f'A request with this {IDEMPOTENCY_HEADER} is still being processed.'
+                },
+                status=status.HTTP_409_CONFLICT)
+
+        try:
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return self.replay(stored, fingerprint)
+            response = super().create(request, *args, **kwargs)
+            #server errors are not stored, the client may retry them
+            if response.status_code < 500:
+                cache.set(
+                    cache_key, {
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                        'headers': dict(response.items()),
+                    }, settings.IDEMPOTENCY_KEY_TTL)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    def wait_for_response(self, cache_key):
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return stored
+        return None
+
+    def replay(self, stored, fingerprint):
+        if stored['fingerprint'] != fingerprint:
+            return Response(
+                {
+                    'detail':
+                    f'This {IDEMPOTENCY_HEADER} was already used with a different request body.'
+                },
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = Response(stored['data'],
+                            status=stored['status'],
+                            headers=stored['headers'])
+        response['Idempotent-Replayed'] = 'true'
+        return response
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Moves old Confirmed/Canceled orders from the live tables into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days',
+                            type=int,
+                            default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help='archive orders older than this many days')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=settings.ORDER_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='seconds to pause between batches, gives other writers room')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def on_batch(moved):
+            self.stdout.write(f'archived {moved} orders')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        total = archive_orders(options['days'],
+                               options['batch_size'],
+                               max_batches=options['max_batches'],
+                               on_batch=on_batch)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{total} orders archived in {time.perf_counter() - started:.1f}s'
+            ))
@@ -0,0 +1,137 @@
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.archive import archive_orders
+from api.models import Order, OrderItem, Product, User
+from api.routers import on_primary
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Hot-path order queries on a large order history, before and after archive_orders. '
+        'Everything runs in one transaction that is rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10_000_000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days-of-history', type=int, default=730)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    #the history only exists in this (rolled back) transaction on the primary
+    @on_primary()
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        started = time.perf_counter()
+        users = self.create_history(options)
+        self.stdout.write(
+            f"{options['orders']} orders created in {time.perf_counter() - started:.0f}s"
+        )
+
+        before = self.measure(users, options['repeat'])
+        started = time.perf_counter()
+        moved = archive_orders(settings.ORDER_ARCHIVE_AFTER_DAYS,
+                               settings.ORDER_ARCHIVE_BATCH_SIZE)
+        self.stdout.write(
+            f'{moved} orders archived in {time.perf_counter() - started:.0f}s, '
+            f'{Order.objects.count()} left in the live table')
+        after = self.measure(users, options['repeat'])
+
+        for name in before:
+            self.stdout.write(f'{name:>22}: {before[name] * 1000:9.2f} ms -> '
+                              f'{after[name] * 1000:9.2f} ms')
+
+    def create_history(self, options):
+        run = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create([
+            User(username=f'bench-{run}-{i}') for i in range(options['users'])
+        ])
+        products = Product.objects.bulk_create([
+            Product(name=f'bench product {i}', price=10, stock=100)
+            for i in range(100)
+        ])
+        now = timezone.now()
+        recent = timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+        history = timedelta(days=options['days_of_history'])
+
+        #the history needs its own timestamps, auto_now_add would stamp every row with now()
+        created_at = Order._meta.get_field('created_at')
+        created_at.auto_now_add = False
+        try:
+            remaining = options['orders']
+            while remaining:
+                chunk = min(remaining, 10000)
+                orders = []
+                for _ in range(chunk):
+                    age = history * random.random()
+                    if age < recent:
+                        status = random.choice(Order.StatusChoices.values)
+                    else:
+                        #old orders are almost all finished
+                        status = random.choices(Order.StatusChoices.values,
+                                                weights=(2, 90, 8))[0]
+                    orders.append(
+                        Order(user=random.choice(users),
+                              status=status,
+                              created_at=now - age))
+                Order.objects.bulk_create(orders)
+                #bulk_create skips OrderItem.save(), so the snapshot is set here
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order,
+                              product=product,
+                              quantity=random.randint(1, 5),
+                              unit_price=product.price,
+                              product_name=product.name) for order in orders
+                    for product in random.sample(products, 2)
+                ])
+                remaining -= chunk
+        finally:
+            created_at.auto_now_add = True
+        return users
+
+    def measure(self, users, repeat):
+        now = timezone.now()
+        user = random.choice(users)
+        latest = Order.objects.filter(user=user).order_by('-created_at')[0]
+        queries = {
+            #what OrderViewSet.list runs for one user
+            'user order list':
+            lambda: list(
+                Order.objects.prefetch_related('items').filter(user=user)),
+            'retrieve by order_id':
+            lambda: Order.objects.prefetch_related('items').get(pk=latest.pk),
+            'filter status=Pending':
+            lambda: Order.objects.filter(status='Pending').count(),
+            'filter last 7 days':
+            lambda: Order.objects.filter(created_at__gt=now - timedelta(days=7)
+                                         ).count(),
+            'count (admin page)':
+            lambda: Order.objects.count(),
+        }
+        timings = {}
+        for name, query in queries.items():
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                query()
+                samples.append(time.perf_counter() - started)
+            timings[name] = statistics.median(samples)
+        return timings
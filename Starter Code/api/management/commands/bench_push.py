@@ -0,0 +1,121 @@
+import asyncio
+import gc
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import push
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        return next(
+            int(line.split()[1]) for line in status
+            if line.startswith('VmRSS:'))
+
+
+class Connection:
+    """
+    A fake ASGI client: sends one GET and stays connected until disconnect() is called.
+    """
+
+    def __init__(self, application, path, query):
+        self.application = application
+        self.scope = {
+            'type': 'http',
+            'asgi': {
+                'version': '3.0'
+            },
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 8000),
+        }
+        self.closed = asyncio.Event()
+        self.requested = False
+        self.events = 0
+        self.received = asyncio.Event()
+        self.task = None
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.body' and message.get('body'):
+            self.events += 1
+            if self.events > 1:
+                #the first chunk is the retry: line
+                self.received.set()
+
+    def open(self):
+        self.task = asyncio.ensure_future(
+            self.application(self.scope, self.receive, self.send))
+
+    def disconnect(self):
+        self.closed.set()
+
+
+class Command(BaseCommand):
+    help = (
+        'Opens N idle /push/ connections in this process through the ASGI application '
+        'and reports the memory each one costs and how long one event takes to reach all'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=100)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        from drf_course.asgi import application
+
+        n = options['subscribers']
+        gc.collect()
+        before = rss_kb()
+        started = time.perf_counter()
+        connections = []
+        for i in range(n):
+            connection = Connection(application, '/push/',
+                                    f"products={i % options['products'] + 1}")
+            connection.open()
+            connections.append(connection)
+        while push.hub.subscriber_count() < n:
+            await asyncio.sleep(0.05)
+        connected = time.perf_counter() - started
+        gc.collect()
+        per_subscriber = (rss_kb() - before) * 1024 / n
+        self.stdout.write(f'{n} subscribers connected in {connected:.1f}s, '
+                          f'{per_subscriber / 1024:.1f} KB RSS each '
+                          f'({(rss_kb() - before) / 1024:.0f} MB in total)')
+
+        #one event per product topic, every subscriber gets exactly one
+        started = time.perf_counter()
+        for pk in range(1, options['products'] + 1):
+            push.hub.dispatch(push.product_topic(pk), 'product', {
+                'id': pk,
+                'stock': 0,
+                'is_in_stock': False
+            })
+        await asyncio.gather(*(c.received.wait() for c in connections))
+        self.stdout.write(
+            f'fan-out of {options["products"]} events to {n} subscribers: '
+            f'{(time.perf_counter() - started) * 1000:.0f} ms')
+
+        for connection in connections:
+            connection.disconnect()
+        await asyncio.gather(*(c.task for c in connections))
+        self.stdout.write(
+            f'{push.hub.subscriber_count()} subscribers left after disconnecting'
+        )
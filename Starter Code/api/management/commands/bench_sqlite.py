@@ -0,0 +1,125 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCHEMA = """
+CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price NUMERIC, stock INTEGER);
+CREATE TABLE "order" (id INTEGER PRIMARY KEY, user_id INTEGER, status TEXT, created_at TEXT);
+CREATE TABLE orderitem (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, quantity INTEGER);
+CREATE INDEX orderitem_order ON orderitem(order_id);
+"""
+
+
+class Command(BaseCommand):
+    help = ('Concurrent read/write benchmark on a scratch SQLite file, '
+            'default settings vs the SQLITE_PRAGMAS tuning mode')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+
+    def handle(self, *args, **options):
+        for tuned in (False, True):
+            result = self.run(tuned, options)
+            label = 'tuned  ' if tuned else 'default'
+            self.stdout.write(
+                f"{label}: {result['writes'] / options['seconds']:8.1f} orders/s  "
+                f"{result['reads'] / options['seconds']:9.1f} reads/s  "
+                f"{result['lock_errors']} 'database is locked' errors")
+
+    def connect(self, path, tuned):
+        if not tuned:
+            #what Django does out of the box: default journal, DEFERRED transactions
+            return sqlite3.connect(path,
+                                   timeout=5,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        conn = sqlite3.connect(
+            path,
+            timeout=settings.SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            isolation_level=None,
+            check_same_thread=False)
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def run(self, tuned, options):
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        setup = self.connect(path, tuned)
+        setup.executescript(SCHEMA)
+        setup.executemany(
+            'INSERT INTO product (name, price, stock) VALUES (?, ?, ?)',
+            [(f'product {i}', 9.99, 100) for i in range(100)])
+        setup.close()
+
+        counts = {'writes': 0, 'reads': 0, 'lock_errors': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+        begin = 'BEGIN IMMEDIATE' if tuned else 'BEGIN'
+
+        def writer():
+            conn = self.connect(path, tuned)
+            while time.perf_counter() < deadline:
+                try:
+                    #same shape as OrderCreateSerializer.create: read, then insert the order and its items
+                    conn.execute(begin)
+                    conn.execute('SELECT price FROM product WHERE id = ?',
+                                 (random.randint(1, 100), )).fetchone()
+                    order_id = conn.execute(
+                        'INSERT INTO "order" (user_id, status, created_at) '
+                        "VALUES (1, 'Pending', datetime('now'))").lastrowid
+                    conn.executemany(
+                        'INSERT INTO orderitem (order_id, product_id, quantity) VALUES (?, ?, ?)',
+                        [(order_id, random.randint(1, 100), 1)
+                         for _ in range(2)])
+                    conn.execute('COMMIT')
+                    with lock:
+                        counts['writes'] += 1
+                except sqlite3.OperationalError as e:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    if 'locked' not in str(e):
+                        raise
+                    with lock:
+                        counts['lock_errors'] += 1
+            conn.close()
+
+        def reader():
+            conn = self.connect(path, tuned)
+            while time.perf_counter() < deadline:
+                try:
+                    conn.execute('SELECT o.id, count(i.id) FROM "order" o '
+                                 'LEFT JOIN orderitem i ON i.order_id = o.id '
+                                 'GROUP BY o.id ORDER BY o.id DESC LIMIT 20'
+                                 ).fetchall()
+                    with lock:
+                        counts['reads'] += 1
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    with lock:
+                        counts['lock_errors'] += 1
+            conn.close()
+
+        threads = [
+            threading.Thread(target=writer) for _ in range(options['writers'])
+        ] + [
+            threading.Thread(target=reader) for _ in range(options['readers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return counts
@@ -0,0 +1,60 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+#what a worker does before it can serve its first request
+#(resident memory is read from /proc: ru_maxrss survives fork + exec, it would report the parent's peak)
+BOOT = """
+import json, sys, time
+started = time.perf_counter()
+import drf_course.wsgi
+booted = time.perf_counter() - started
+with open('/proc/self/status') as status:
+    rss_kb = next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+print(json.dumps({'boot': booted, 'rss_kb': rss_kb, 'modules': len(sys.modules)}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measures cold start time and memory of a worker process per settings profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument(
+            '--profile',
+            action='append',
+            dest='profiles',
+            help='settings module to measure (default: both profiles)')
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'] or [
+            'drf_course.settings', 'drf_course.settings_api'
+        ]
+        for profile in profiles:
+            env = {**os.environ, 'DJANGO_SETTINGS_MODULE': profile}
+            walls, boots, rss, modules = [], [], [], 0
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                #a fresh interpreter every run: nothing is imported or cached yet
+                result = subprocess.run([sys.executable, '-c', BOOT],
+                                        cwd=settings.BASE_DIR,
+                                        env=env,
+                                        capture_output=True,
+                                        text=True,
+                                        check=True)
+                walls.append(time.perf_counter() - started)
+                stats = json.loads(result.stdout.strip().splitlines()[-1])
+                boots.append(stats['boot'])
+                rss.append(stats['rss_kb'])
+                modules = stats['modules']
+            self.stdout.write(
+                f'{profile}: process start {statistics.median(walls) * 1000:.0f} ms, '
+                f'django boot {statistics.median(boots) * 1000:.0f} ms, '
+                f'RSS {statistics.median(rss) / 1024:.1f} MB, {modules} modules '
+                f'(median of {options["runs"]} runs)')
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import throttling
+
+
+class Command(BaseCommand):
+    help = 'Measures the time a token bucket throttle adds to each request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100000)
+        parser.add_argument('--clients', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        requests = [
+            Request(
+                factory.get('/products/',
+                            REMOTE_ADDR=f'10.0.{i // 256}.{i % 256}'))
+            for i in range(options['clients'])
+        ]
+        throttle = throttling.ProductBrowseThrottle()
+        #a huge budget so every call takes the "allowed" path
+        capacity, refill = 10**9, 10**9
+
+        backends = {'local': throttling.take_token_local}
+        script = throttling._get_redis_script()
+        if script is not None:
+            try:
+                throttling.take_token_redis(script, 'throttle:bench', 1, 1)
+            except Exception as e:
+                self.stdout.write(f'redis: unavailable ({e})')
+            else:
+                backends['redis'] = (
+                    lambda key, capacity, refill: throttling.take_token_redis(
+                        script, key, capacity, refill))
+
+        n = options['requests']
+        for name, take_token in backends.items():
+            started = time.perf_counter()
+            for i in range(n):
+                request = requests[i % len(requests)]
+                take_token(throttle.get_cache_key(request, None), capacity,
+                           refill)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{name:>5}: {elapsed / n * 1e6:7.2f} us per request '
+                f'({n} requests, {len(requests)} clients)')
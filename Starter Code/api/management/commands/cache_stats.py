@@ -0,0 +1,18 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Shows hit ratios per tier of the two-tier cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', default='default')
+
+    def handle(self, *args, **options):
+        backend = caches[options['alias']]
+        if not hasattr(backend, 'stats'):
+            raise CommandError(
+                f"Cache '{options['alias']}' is not a TieredCache.")
+        for tier, stats in backend.stats().items():
+            self.stdout.write(
+                f"{tier:>6}: {stats['count']:>10}  {stats['ratio']:6.1%}")
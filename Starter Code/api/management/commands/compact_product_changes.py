@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.changefeed import compact_log
+from api.routers import on_primary
+
+
+class Command(BaseCommand):
+    help = 'Removes product change log entries superseded by a newer change of the same product'
+
+    @on_primary()
+    def handle(self, *args, **options):
+        deleted = compact_log()
+        self.stdout.write(
+            self.style.SUCCESS(f'{deleted} superseded changes removed'))
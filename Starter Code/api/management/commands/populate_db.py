@@ -4,11 +4,13 @@ from decimal import Decimal
 from django.core.management.base import BaseCommand
 from django.utils import lorem_ipsum
 from api.models import User, Product, Order, OrderItem
+from api.routers import on_primary
 
 
 class Command(BaseCommand):
     help = 'Creates application data'
 
+    @on_primary()
     def handle(self, *args, **kwargs):
         # get or create superuser
         user = User.objects.filter(username='admin').first()
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api import taskqueue
+from api.routers import on_primary
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once',
+                            action='store_true',
+                            help='Run every due task and exit')
+        parser.add_argument('--sleep',
+                            type=float,
+                            default=1,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--requeue-after',
+            type=int,
+            default=600,
+            help='Requeue tasks stuck in Running for this many seconds')
+
+    def handle(self, *args, **options):
+        requeued = taskqueue.requeue_stale(
+            timedelta(seconds=options['requeue_after']))
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale task(s)')
+
+        while True:
+            current = taskqueue.claim_next()
+            if current is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+            #one task, one "request": its writes must not pin the worker's next tasks
+            with on_primary():
+                current = taskqueue.run(current)
+            self.stdout.write(f'{current.name} {current.pk}: {current.status}')
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Shows the SQLite PRAGMAs in effect next to the ones configured in settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                f"Database '{options['database']}' is not SQLite "
+                f"({connection.vendor}).")
+
+        db_options = connection.settings_dict['OPTIONS']
+        tuned = 'init_command' in db_options
+        self.stdout.write(f"database: {connection.settings_dict['NAME']}")
+        self.stdout.write(f"tuning mode: {'on' if tuned else 'off'}")
+        self.stdout.write(
+            f"transaction mode: {db_options.get('transaction_mode', 'DEFERRED')}"
+        )
+
+        with connection.cursor() as cursor:
+            for name, expected in settings.SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {name}')
+                row = cursor.fetchone()
+                actual = row[0] if row else None
+                line = f'{name}: {actual}'
+                if tuned:
+                    line += f' (configured {expected})'
+                self.stdout.write(line)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.warmup import warm_cache
+
+
+class Command(BaseCommand):
+    help = 'Fills the product list and order list caches, run it after a deploy or a Redis flush'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency',
+                            type=int,
+                            default=settings.WARM_CACHE_CONCURRENCY,
+                            help='views warmed at the same time')
+        parser.add_argument('--top',
+                            type=int,
+                            default=settings.WARM_CACHE_TOP_PRODUCT_QUERIES,
+                            help='most requested product list queries to warm')
+        parser.add_argument('--users',
+                            type=int,
+                            default=settings.WARM_CACHE_ACTIVE_USERS,
+                            help='most recently active users to warm')
+
+    def handle(self, *args, **options):
+        report = warm_cache(options['concurrency'], options['top'],
+                            options['users'])
+        covered = report['traffic_covered']
+        self.stdout.write(f"{report['product_paths']} product list queries, "
+                          f"{report['users']} users' order lists, "
+                          f"{report['failed']} failed")
+        if covered is not None:
+            self.stdout.write(
+                f'{covered:.0%} of the recorded product list traffic covered')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{report['warmed']} cache entries warmed in {report['seconds']:.1f}s "
+                f"with {options['concurrency']} workers"))
@@ -0,0 +1,18 @@
+from api.routers import unpin
+
+
+class PrimaryPinningMiddleware:
+    """
+    Clears the "read from primary" pin at the start and end of every request,
+    so a write in one request never pins an unrelated request that reuses the same thread.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unpin()
+        try:
+            return self.get_response(request)
+        finally:
+            unpin()
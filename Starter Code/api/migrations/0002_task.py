@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id',
+                 models.BigAutoField(auto_created=True,
+                                     primary_key=True,
+                                     serialize=False,
+                                     verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('idempotency_key',
+                 models.CharField(blank=True,
+                                  max_length=255,
+                                  null=True,
+                                  unique=True)),
+                ('status',
+                 models.CharField(choices=[('Queued', 'Queued'),
+                                           ('Running', 'Running'),
+                                           ('Done', 'Done'),
+                                           ('Failed', 'Failed')],
+                                  default='Queued',
+                                  max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_at',
+                 models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['status', 'run_at'],
+                                 name='api_task_status_43794d_idx')
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+def log_existing_products(apps, schema_editor):
+    """
+    Start the log with one upsert per existing product, so since=0 returns the whole catalog.
+    """
+    Product = apps.get_model('api', 'Product')
+    ProductChange = apps.get_model('api', 'ProductChange')
+    product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+    ProductChange.objects.bulk_create(
+        (ProductChange(product_id=pk, action='upsert') for pk in product_ids),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductChange',
+            fields=[
+                ('id',
+                 models.BigAutoField(auto_created=True,
+                                     primary_key=True,
+                                     serialize=False,
+                                     verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('action',
+                 models.CharField(choices=[('upsert', 'Upsert'),
+                                           ('delete', 'Delete')],
+                                  max_length=6)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['product_id', 'id'],
+                                 name='api_product_product_5b3182_idx')
+                ],
+            },
+        ),
+        migrations.RunPython(log_existing_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def snapshot_prices(apps, schema_editor):
+    """
+    Copies the current product price and name into the existing items, one id range at a time:
+    every batch is a single UPDATE ... SET unit_price = (SELECT price ...) in its own transaction,
+    so a large table is never locked for the whole backfill.
+    """
+    #the database being migrated, not necessarily 'default'
+    alias = schema_editor.connection.alias
+    Product = apps.get_model('api', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    for name in ('OrderItem', 'ArchivedOrderItem'):
+        model = apps.get_model('api', name)
+        missing = model.objects.using(alias).filter(unit_price__isnull=True)
+        bounds = missing.aggregate(first=models.Min('pk'),
+                                   last=models.Max('pk'))
+        if bounds['first'] is None:
+            continue
+        for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+            with transaction.atomic(using=alias):
+                missing.filter(
+                    pk__gte=start, pk__lt=start + BATCH_SIZE).update(
+                        unit_price=Subquery(product.values('price')[:1]),
+                        product_name=Subquery(product.values('name')[:1]))
+
+
+class Migration(migrations.Migration):
+    #the backfill commits batch by batch instead of in one long transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0004_product_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2,
+                                      max_digits=10,
+                                      null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2,
+                                      max_digits=10,
+                                      null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='product_name',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(snapshot_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='product_name',
+            field=models.CharField(max_length=255),
+        ),
+    ]
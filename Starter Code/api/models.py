@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 import uuid
 
 
@@ -47,6 +48,29 @@ class Product(models.Model):
     """
 
 
+class ProductChange(models.Model):
+    """
+    Append-only log of product writes, filled by the Product signals (see api/changefeed.py).
+    The auto-increment id is the sync token clients pass to /products/changes?since=.
+    """
+
+    class ActionChoices(models.TextChoices):
+        UPSERT = 'upsert'
+        DELETE = 'delete'
+
+    product_id = models.BigIntegerField()
+    #not a ForeignKey: the entry has to outlive the product it records the deletion of
+    action = models.CharField(max_length=6, choices=ActionChoices.choices)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['product_id', 'id'])]
+        #finding the latest change per product (compaction) walks this index
+
+    def __str__(self):
+        return f"#{self.pk} {self.action} product {self.product_id}"
+
+
 class Order(models.Model):
 
     class StatusChoices(models.TextChoices):
@@ -88,6 +112,10 @@ class Order(models.Model):
     #which allows for additional fields (like quantity) in the relationship.
     #related_name='orders' allows you to access all orders containing a specific product via product
 
+    class Meta:
+        indexes = [models.Index(fields=['created_at'])]
+        #OrderFilter's date filters and the archiver (oldest orders first) both look orders up by created_at
+
     def __str__(self):
         return f"Order {self.order_id} by {self.user.username}"
 
@@ -109,10 +137,103 @@ class OrderItem(models.Model):
     )
 
     quantity = models.PositiveIntegerField()
+    #copies of the product's price and name when the item was created:
+    #reading an order needs no product, and later price changes don't rewrite old totals
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    product_name = models.CharField(max_length=255)
 
     @property
     def item_subtotal(self):
-        return self.quantity * self.product.price
+        return self.quantity * self.unit_price
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            if self.unit_price is None:
+                self.unit_price = self.product.price
+            if not self.product_name:
+                self.product_name = self.product.name
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_name} in Order {self.order_id}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    An old, finished (Confirmed/Canceled) order moved out of the live Order table by
+    `python manage.py archive_orders` (see api/archive.py). Same columns as Order,
+    so OrderViewSet can still return it by order_id.
+    """
+    order_id = models.UUIDField(primary_key=True)
+    #no default: the archived order keeps the order_id it had in the live table
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='archived_orders')
+    created_at = models.DateTimeField()
+    #copied from the live order, not auto_now_add
+    status = models.CharField(max_length=10,
+                              choices=Order.StatusChoices.choices)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived order {self.order_id} by {self.user.username}"
+
+
+class ArchivedOrderItem(models.Model):
+    """
+    An item of an archived order.
+    """
+    order = models.ForeignKey(ArchivedOrder,
+                              related_name='items',
+                              on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    product_name = models.CharField(max_length=255)
+
+    @property
+    def item_subtotal(self):
+        return self.quantity * self.unit_price
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_name} in archived order {self.order_id}"
+
+
+class Task(models.Model):
+    """
+    A unit of background work, stored in the database which doubles as the queue (see api/taskqueue.py).
+    """
+
+    class StatusChoices(models.TextChoices):
+        QUEUED = 'Queued'
+        RUNNING = 'Running'
+        DONE = 'Done'
+        FAILED = 'Failed'
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    idempotency_key = models.CharField(max_length=255,
+                                       unique=True,
+                                       null=True,
+                                       blank=True)
+    #unique=True with null=True: tasks without a key never collide, tasks with the same key are only queued once.
+    status = models.CharField(
+        max_length=10,
+        choices=StatusChoices.choices,
+        default=StatusChoices.QUEUED,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    #run_at is pushed into the future when a failed task is retried (backoff)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+        #the worker looks for the next queued task whose run_at has passed, this index makes that lookup cheap
 
     def __str__(self):
-        return f"{self.quantity} of {self.product.name} in Order {self.order.order_id}"
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,341 @@
+"""
+Server-sent events for stock and order status changes, so clients stop polling.
+
+    GET /push/?products=1,2,3          stock of these products
+    GET /push/?orders=1                status of the authenticated user's orders
+
+    event: product
+    data: {"id": 1, "stock": 4, "is_in_stock": true}
+
+    event: order
+    data: {"order_id": "...", "status": "Confirmed"}
+
+Served by drf_course/asgi.py next to Django (uvicorn drf_course.asgi:application), not through
+Django's request handling: that keeps a thread per open request, here every connection is just
+a coroutine parked on its own queue. Order updates need a JWT access token, in the Authorization
+header or, because browsers' EventSource cannot send headers, as ?access_token=.
+
+Changes are published after their transaction commits and fanned out by the in-process Hub. With PUSH_REDIS_URL set, every process publishes to
+a Redis channel instead and forwards what it receives from there to its own Hub, so subscribers on
+every node see changes made on any node.
+
+A subscriber that falls PUSH_QUEUE_SIZE events behind gets an `event: resync` and should
+re-fetch the state over the REST API.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import transaction
+from django.http.request import split_domain_port, validate_host
+
+logger = logging.getLogger(__name__)
+
+REDIS_CHANNEL = 'push'
+RESYNC = b'event: resync\ndata: {}\n\n'
+STREAM_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    #nginx would otherwise buffer the stream
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def product_topic(product_id):
+    return f'product:{product_id}'
+
+
+def orders_topic(user_id):
+    return f'orders:{user_id}'
+
+
+def encode(kind, data):
+    return f'event: {kind}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+class Subscriber:
+    #__slots__: 10k idle connections per process should cost as little as possible
+    __slots__ = ('topics', 'queue', 'loop', 'overflowed')
+
+    def __init__(self, topics, loop):
+        self.topics = topics
+        self.queue = asyncio.Queue(settings.PUSH_QUEUE_SIZE)
+        self.loop = loop
+        self.overflowed = False
+
+    def deliver(self, event):
+        #runs in the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            #too slow: drop the event and tell the client to re-fetch once it caught up
+            self.overflowed = True
+
+
+class Hub:
+    """
+    In-process fan-out: topic -> subscribers.
+    dispatch() can be called from any thread, delivery happens in the subscribers' event loops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+        #last event per topic, a save that did not change stock/status is not sent again
+        self._last = {}
+
+    def subscribe(self, topics):
+        subscriber = Subscriber(tuple(topics), asyncio.get_running_loop())
+        with self._lock:
+            for topic in subscriber.topics:
+                self._topics.setdefault(topic, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            for topic in subscriber.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._topics[topic]
+                    self._last.pop(topic, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subs in self._topics.values() for s in subs})
+
+    def dispatch(self, topic, kind, data):
+        with self._lock:
+            subscribers = self._topics.get(topic)
+            if not subscribers:
+                return 0
+            event = encode(kind, data)
+            if self._last.get(topic) == event:
+                return 0
+            self._last[topic] = event
+            by_loop = {}
+            for subscriber in subscribers:
+                by_loop.setdefault(subscriber.loop, []).append(subscriber)
+        #one wake-up per event loop, not one per subscriber
+        for loop, batch in by_loop.items():
+            loop.call_soon_threadsafe(_deliver_all, batch, event)
+        return sum(len(batch) for batch in by_loop.values())
+
+
+def _deliver_all(subscribers, event):
+    for subscriber in subscribers:
+        subscriber.deliver(event)
+
+
+hub = Hub()
+
+
+class LocalBackend:
+    """
+    Single process: publishing is dispatching to the local hub.
+    """
+
+    def publish(self, topic, kind, data):
+        hub.dispatch(topic, kind, data)
+
+    def start(self):
+        pass
+
+
+class RedisBackend(LocalBackend):
+    """
+    Several processes/nodes: publish to a Redis channel, every process listens on it
+    (in a background thread, started with the first subscriber) and dispatches locally.
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def publish(self, topic, kind, data):
+        try:
+            self.client.publish(REDIS_CHANNEL, json.dumps([topic, kind, data]))
+        except Exception:
+            #pushes are best effort, the write itself already succeeded
+            logger.exception('Could not publish %s to Redis', topic)
+
+    def start(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self.listen,
+                                                  name='push-redis',
+                                                  daemon=True)
+                self._listener.start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REDIS_CHANNEL)
+                for message in pubsub.listen():
+                    hub.dispatch(*json.loads(message['data']))
+            except Exception:
+                logger.exception('Push listener lost Redis, reconnecting')
+                time.sleep(1)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if settings.PUSH_REDIS_URL:
+            _backend = RedisBackend(settings.PUSH_REDIS_URL)
+        else:
+            _backend = LocalBackend()
+    return _backend
+
+
+def publish(topic, kind, data):
+    """
+    Sends the event once the current transaction commits (right away outside a transaction),
+    so nobody is told about a change that is rolled back.
+    """
+    transaction.on_commit(lambda: get_backend().publish(topic, kind, data))
+
+
+async def stream(topics):
+    """
+    The body of a /push/ response. Subscribes when the server starts sending it,
+    unsubscribes when the client goes away (the server cancels the iteration).
+    """
+    get_backend().start()
+    subscriber = hub.subscribe(topics)
+    try:
+        #EventSource reconnects after this many milliseconds when the connection drops
+        yield b'retry: 3000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(),
+                                               settings.PUSH_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                #keeps proxies from closing an idle connection
+                yield b': ping\n\n'
+                continue
+            yield event
+            if subscriber.overflowed and subscriber.queue.empty():
+                subscriber.overflowed = False
+                yield RESYNC
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+def token_user_id(raw_token):
+    """
+    The user id inside a valid access token. Only the signature and expiry are checked,
+    no database query: the connection then stays open without ever touching the database.
+    """
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.settings import api_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    try:
+        return AccessToken(raw_token)[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+def parse_request(scope):
+    """
+    The topics asked for in the query string, or (status, error) for a bad request.
+    """
+    headers = {name.lower(): value for name, value in scope['headers']}
+    host, _ = split_domain_port(headers.get(b'host', b'').decode('latin1'))
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        #what Django's own host check allows in development
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    if not validate_host(host, allowed_hosts):
+        return None, (400, 'Invalid host.')
+
+    query = parse_qs(scope['query_string'].decode())
+    try:
+        product_ids = [
+            int(pk) for value in query.get('products', [])
+            for pk in value.split(',') if pk.strip()
+        ]
+    except ValueError:
+        return None, (400, 'products must be comma separated ids.')
+    topics = [product_topic(pk) for pk in dict.fromkeys(product_ids)]
+
+    if query.get('orders'):
+        authorization = headers.get(b'authorization', b'').decode('latin1')
+        raw_token = authorization.partition('Bearer ')[2] or query.get(
+            'access_token', [''])[0]
+        user_id = token_user_id(raw_token) if raw_token else None
+        if user_id is None:
+            return None, (401, 'A valid access token is required for orders.')
+        topics.append(orders_topic(user_id))
+
+    if not topics:
+        return None, (400, 'Subscribe to products or orders.')
+    if len(topics) > settings.PUSH_MAX_TOPICS:
+        return None, (400,
+                      f'At most {settings.PUSH_MAX_TOPICS} subscriptions.')
+    return topics, None
+
+
+async def send_error(send, status, detail):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': json.dumps({
+            'detail': detail
+        }).encode(),
+    })
+
+
+async def application(scope, receive, send):
+    """
+    ASGI application for GET /push/, mounted in drf_course/asgi.py.
+    """
+    if scope['method'] != 'GET':
+        return await send_error(send, 405, 'Method not allowed.')
+    topics, error = parse_request(scope)
+    if error:
+        return await send_error(send, *error)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': STREAM_HEADERS,
+    })
+
+    async def pump():
+        async for chunk in stream(topics):
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': True
+            })
+
+    pumping = asyncio.ensure_future(pump())
+    try:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    finally:
+        #the client is gone: cancelling the pump unsubscribes it
+        pumping.cancel()
+        try:
+            await pumping
+        except (asyncio.CancelledError, OSError):
+            pass
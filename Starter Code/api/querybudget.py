@@ -0,0 +1,173 @@
+"""
+Catches N+1 queries and views that run more queries than they declared.
+
+Every SQL statement of a request is reduced to its shape (literals replaced by ?).
+The same shape running QUERY_INSPECTOR_NPLUSONE_THRESHOLD times or more is reported as N+1,
+together with the serializer field that triggered it (e.g. UserSerializer.orders).
+A view can declare a budget:
+
+    class ProductDetailAPIView(...):
+        query_budget = 3                             # every action
+        query_budget = {'list': 3, 'retrieve': 2}    # per viewset action
+        query_budget = {'get': 3, 'patch': 5}        # per HTTP method (other views)
+
+Loops that run the same statements once per chunk on purpose (bulk updates) run inside batched():
+their queries still count towards the budget, but are not reported as N+1.
+
+In development problems are logged as warnings, with QUERY_BUDGET_STRICT (the test runner turns it on)
+they raise QueryBudgetExceeded. When QUERY_INSPECTOR_ENABLED is off the middleware removes itself.
+"""
+import logging
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.fields import Field
+
+logger = logging.getLogger(__name__)
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LISTS = re.compile(r'\bIN \((?:\?|%s)(?:, (?:\?|%s))*\)')
+_batched = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    """
+    SELECT ... WHERE "user_id" = 1  ->  SELECT ... WHERE "user_id" = ?
+    """
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _IN_LISTS.sub('IN (...)', sql)
+    return sql
+
+
+@contextmanager
+def batched():
+    """
+    Marks a chunked loop: the repeated statements inside are intended, not N+1.
+    """
+    previous = getattr(_batched, 'active', False)
+    _batched.active = True
+    try:
+        yield
+    finally:
+        _batched.active = previous
+
+
+def find_origin():
+    """
+    The serializer field whose value is being read when the query runs, if any.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        field = frame.f_locals.get('self')
+        #type() instead of isinstance(): isinstance() would evaluate lazy objects such as request.user
+        if issubclass(type(field),
+                      Field) and field.field_name and field.parent:
+            return f'{type(field.parent).__name__}.{field.field_name}'
+        frame = frame.f_back
+    return None
+
+
+class QueryInspector:
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith('EXPLAIN'):
+            #silk explains every query it records, that is profiling overhead, not the view's queries
+            return execute(sql, params, many, context)
+        self.count += 1
+        if getattr(_batched, 'active', False):
+            return execute(sql, params, many, context)
+        shape = fingerprint(sql)
+        self.shapes[shape] += 1
+        if shape not in self.origins:
+            self.origins[shape] = find_origin()
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def watch(self):
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+    def problems(self, budget=None):
+        found = []
+        threshold = settings.QUERY_INSPECTOR_NPLUSONE_THRESHOLD
+        for shape, count in self.shapes.items():
+            if count >= threshold:
+                origin = self.origins[shape] or 'unknown origin'
+                found.append(
+                    f'N+1 query ({count}x, from {origin}): {shape[:300]}')
+        if budget is not None and self.count > budget:
+            found.append(f'{self.count} queries, the budget is {budget}')
+        return found
+
+    def report(self, label, budget=None, raise_errors=None):
+        if raise_errors is None:
+            raise_errors = settings.QUERY_BUDGET_STRICT
+        found = self.problems(budget)
+        if not found:
+            return
+        message = f'{label}: ' + '; '.join(found)
+        if raise_errors:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+@contextmanager
+def inspect_queries(budget=None, label='queries', raise_errors=True):
+    """
+    Test hook: fails the block on N+1 queries or when it runs more than `budget` queries.
+
+        with inspect_queries(budget=3):
+            self.client.get('/orders/')
+    """
+    inspector = QueryInspector()
+    with inspector.watch():
+        yield inspector
+    inspector.report(label, budget, raise_errors)
+
+
+def view_budget(request):
+    match = request.resolver_match
+    view_class = getattr(match.func, 'cls', None) if match else None
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        #viewsets: the router maps the HTTP method to an action name
+        method = request.method.lower()
+        actions = getattr(match.func, 'actions', {})
+        budget = budget.get(actions.get(method, method))
+    return budget
+
+
+class QueryInspectorMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            #Django drops the middleware entirely, so it costs nothing when disabled
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inspector = QueryInspector()
+        with inspector.watch():
+            response = self.get_response(request)
+        inspector.report(f'{request.method} {request.path}',
+                         view_budget(request))
+        return response
@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICA_ALIAS = 'replica'
+
+#The pin lives in a thread local, reset by the middleware for requests and by on_primary() elsewhere
+_state = threading.local()
+
+
+def pin_to_primary():
+    _state.pinned = True
+
+
+def unpin():
+    _state.pinned = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+@contextmanager
+def on_primary():
+    """
+    Every read of the block (or decorated function) goes to the primary, and afterwards the pin
+    is what it was before: what PrimaryPinningMiddleware does for a request, for code outside
+    requests (the task worker, management commands). Nests, an inner block keeps the outer pin.
+    """
+    was_pinned = is_pinned()
+    pin_to_primary()
+    try:
+        yield
+    finally:
+        _state.pinned = was_pinned
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def _pin_key(user_id):
+    return f'db_primary_pin:{user_id}'
+
+
+def remember_write(user):
+    """
+    Keep this user's next requests on the primary for REPLICA_PIN_SECONDS,
+    long enough for the replica to catch up with what they just wrote.
+    """
+    if replica_configured():
+        cache.set(_pin_key(user.pk), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def has_recent_write(user):
+    return cache.get(_pin_key(user.pk)) is not None
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads of products and orders to the read replica and every write to the primary.
+    Once a write happens in the current request, the rest of the request reads from the primary too.
+    Without a 'replica' entry in DATABASES everything goes to 'default'.
+    """
+    replica_models = {
+        'product', 'order', 'orderitem', 'archivedorder', 'archivedorderitem',
+        'productchange'
+    }
+
+    def _routed(self, model):
+        return (model._meta.app_label == 'api'
+                and model._meta.model_name in self.replica_models)
+
+    def db_for_read(self, model, **hints):
+        if replica_configured() and self._routed(model) and not is_pinned():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if self._routed(model):
+            pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #primary and replica hold the same data, so relations between them are fine
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+class ReadYourWritesMixin:
+    """
+    View mixin: if the authenticated user wrote something a moment ago
+    (see remember_write) their reads in this request go to the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (replica_configured() and request.user.is_authenticated
+                and has_recent_write(request.user)):
+            pin_to_primary()
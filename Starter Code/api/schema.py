@@ -0,0 +1,101 @@
+"""
+Serves the OpenAPI schema from memory instead of introspecting every view on each request.
+
+The schema is built once per process: read from the checked-in schema.yml when
+OPENAPI_SCHEMA_PRECOMPUTED is on (production), otherwise generated from the code on first use
+(runserver restarts on every code change, so development never sees a stale schema).
+Both the YAML and the JSON body are kept compressed as well (see api/compression.py),
+with an ETag per variant for conditional requests.
+
+After changing a view or a serializer, regenerate the file:
+
+    python manage.py spectacular --file schema.yml
+
+SchemaDriftTestCase fails as long as schema.yml and the code disagree.
+"""
+import functools
+import hashlib
+import json
+
+import yaml
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_GET
+
+from api.compression import compressed_variants, negotiate
+
+YAML_CONTENT_TYPE = 'application/vnd.oai.openapi'
+JSON_CONTENT_TYPE = 'application/vnd.oai.openapi+json'
+
+
+def generate_schema():
+    """
+    The YAML `manage.py spectacular` writes, byte for byte.
+    """
+    from drf_spectacular.renderers import OpenApiYamlRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+    return OpenApiYamlRenderer().render(schema, renderer_context={})
+
+
+def _variant(body, content_type):
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    #the compressed bytes are deterministic, so are their ETags across processes
+    encodings = {
+        coding: (compressed, f'"{digest}-{coding}"')
+        for coding, compressed in compressed_variants(body,
+                                                      content_type).items()
+    }
+    encodings['identity'] = (body, f'"{digest}"')
+    return {'content_type': content_type, 'encodings': encodings}
+
+
+@functools.cache
+def load_schema():
+    if settings.OPENAPI_SCHEMA_PRECOMPUTED:
+        with open(settings.OPENAPI_SCHEMA_FILE, 'rb') as f:
+            body = f.read()
+    else:
+        body = generate_schema()
+    as_json = json.dumps(yaml.safe_load(body), indent=2).encode()
+    return {
+        'yaml': _variant(body, YAML_CONTENT_TYPE),
+        'json': _variant(as_json, JSON_CONTENT_TYPE),
+    }
+
+
+def _wants_json(request):
+    requested = request.GET.get('format')
+    if requested:
+        return requested == 'json'
+    return 'json' in request.headers.get('Accept', '')
+
+
+@require_GET
+def schema_view(request):
+    """
+    Same content as drf_spectacular's SpectacularAPIView:
+    YAML by default, JSON with ?format=json or `Accept: application/json`.
+    """
+    variant = load_schema()['json' if _wants_json(request) else 'yaml']
+    encodings = variant['encodings']
+    encoding = negotiate(
+        request.headers.get('Accept-Encoding', ''),
+        [coding for coding in encodings if coding != 'identity']) or 'identity'
+    body, etag = encodings[encoding]
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type=variant['content_type'])
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    #clients may keep it, but have to revalidate (a cheap 304) before using it
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
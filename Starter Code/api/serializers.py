@@ -1,12 +1,87 @@
+from django.conf import settings
 from django.db import transaction
 from rest_framework import serializers
-from .models import Order, Product, OrderItem, User
+from .models import ArchivedOrder, ArchivedOrderItem, Order, Product, OrderItem, User
+from .transitions import ALLOWED_TRANSITIONS
 """
 Converting model instances to JSON (so you can send them in an API response).
 Validating and converting incoming JSON to model instances (so you can save data from API requests).
 """
 
 
+def requested_fieldset(request):
+    """
+    Reads ?fields=name,price and ?exclude=description from a GET request.
+    Returns (fields, exclude) as sets, either can be empty.
+    Nested fields use dots: ?fields=order_id,items.quantity
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return set(), set()
+
+    def parse(param):
+        value = request.query_params.get(param, '')
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    return parse('fields'), parse('exclude')
+
+
+class SparseFieldsetsMixin:
+    """
+    Lets the client choose which fields it gets back with ?fields= / ?exclude=.
+    Works for nested serializers too, they look at the names under their own prefix
+    (e.g. 'items.' for OrderSerializer.items).
+    Only GET requests are affected, writes always validate every field.
+    """
+
+    def fieldset_prefix(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            #the child of a many=True field has an empty field_name, its ListSerializer has the real one
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        include, exclude = requested_fieldset(self.context.get('request'))
+        if not include and not exclude:
+            return fields
+
+        prefix = self.fieldset_prefix()
+        path = f'{prefix}.' if prefix else ''
+        nested_include = {
+            name[len(path):]
+            for name in include if name.startswith(path)
+        }
+        nested_exclude = {
+            name[len(path):]
+            for name in exclude if name.startswith(path)
+        }
+
+        #?fields=items (without any items.<name>) leaves nested_include empty: all item fields
+        for name in list(fields):
+            keep = (not nested_include or name in nested_include
+                    or any(n.startswith(f'{name}.') for n in nested_include))
+            if not keep or name in nested_exclude:
+                fields.pop(name)
+        return fields
+
+
+def prune_queryset(queryset, fields):
+    """
+    Pushes a sparse fieldset down to SQL: only the columns behind the remaining
+    serializer fields are selected (plus the primary key), e.g. description is left out.
+    """
+    concrete = {field.name for field in queryset.model._meta.concrete_fields}
+    columns = {
+        field.source
+        for field in fields.values() if field.source in concrete
+    }
+    return queryset.only(queryset.model._meta.pk.name, *columns)
+
+
 class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -15,7 +90,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('username', 'email', 'is_staff', 'is_superuser', 'orders')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Product  # → this serializer is for the Product model.
@@ -34,12 +109,12 @@ class ProductSerializer(serializers.ModelSerializer):
     #DRF automatically calls validate_<fieldname> for the field when data is being deserialized or saved via the API.
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
-    product_name = serializers.CharField(source='product.name')
+class OrderItemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
+    #the price snapshot taken when the item was created, not the product's current price
     product_price = serializers.DecimalField(
         max_digits=10,
         decimal_places=2,
-        source='product.price',
+        source='unit_price',
     )
 
     #product = ProductSerializer(read_only=True) this shows the entire product object inside the order item
@@ -64,11 +139,11 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             fields = ('product', 'quantity')
 
     order_id = serializers.UUIDField(read_only=True)
-    items = OrderItemSerializer(many=True, required=False)
+    items = OrderItemCreateSerializer(many=True, required=False)
 
     def update(self, instance, validated_data):
         with transaction.atomic():
-            order_item_data = validated_data.pop('items')
+            order_item_data = validated_data.pop('items', None)
             instance = super().update(instance, validated_data)
 
             if order_item_data is not None:
@@ -80,12 +155,12 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             return instance
 
     def create(self, validated_data):
-        order_item_data = validated_data.pop('items')
+        order_item_data = validated_data.pop('items', [])
         with transaction.atomic():
             order = Order.objects.create(**validated_data)
             for item in order_item_data:
                 OrderItem.objects.create(order=order, **item)
-            return Order
+            return order
 
     class Meta:
         model = Order
@@ -95,11 +170,10 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             'status',
             'items',
         )
-
-    extra_kwargs = {'user': {'read_only': True}}
+        extra_kwargs = {'user': {'read_only': True}}
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     order_id = serializers.UUIDField(read_only=True)
     #read_only=True → user cannot modify it; it's generated by the system.
     items = OrderItemSerializer(many=True, read_only=True)
@@ -136,6 +210,22 @@ class OrderSerializer(serializers.ModelSerializer):
         )
 
 
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+
+class ArchivedOrderSerializer(OrderSerializer):
+    """
+    Archived orders are returned in exactly the same shape as live ones.
+    """
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
+
 class ProductInfoSerializer(serializers.Serializer):
     """
     get all products, count of products, max_price
@@ -147,3 +237,20 @@ class ProductInfoSerializer(serializers.Serializer):
     products = ProductSerializer(many=True)
     count = serializers.IntegerField()
     max_price = serializers.FloatField()
+
+
+class OrderBulkStatusSerializer(serializers.Serializer):
+    """
+    Input of POST /orders/bulk-status/: the new status, and the orders either by id
+    or by the OrderFilter query parameters (?status=Pending&created_at__lt=2024-01-01).
+    """
+    status = serializers.ChoiceField(choices=list(ALLOWED_TRANSITIONS))
+    ids = serializers.ListField(child=serializers.UUIDField(),
+                                required=False,
+                                allow_empty=False)
+
+    def validate_ids(self, value):
+        if len(value) > settings.ORDER_BULK_STATUS_MAX_IDS:
+            raise serializers.ValidationError(
+                f'At most {settings.ORDER_BULK_STATUS_MAX_IDS} ids.')
+        return value
@@ -1,10 +1,63 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from api.models import Product
 from django.core.cache import cache
+from api.cache import bump_generation, product_cache_key
+from api.changefeed import record_change
+from api.models import Order, OrderItem, Product, ProductChange
+from api.taskqueue import enqueue
+from api import push
+from api import tasks  # registers the tasks
 
 
 @receiver([post_save, post_delete], sender=Product)
 def invalidate_product_cache(sender, instance, **kwargs):
     print("Clearing Product Cache")
-    cache.delete_pattern('*product_list*')
+    #marks the cached pages stale instead of deleting them,
+    #so they can still be served while a single request rebuilds them
+    bump_generation('product_list')
+    cache.delete(product_cache_key(instance.pk))
+
+
+@receiver(post_save, sender=Product)
+def log_product_upsert(sender, instance, **kwargs):
+    #same transaction as the save: no change without its log entry and vice versa
+    record_change(instance.pk, ProductChange.ActionChoices.UPSERT)
+
+
+@receiver(post_delete, sender=Product)
+def log_product_delete(sender, instance, **kwargs):
+    record_change(instance.pk, ProductChange.ActionChoices.DELETE)
+
+
+@receiver(post_save, sender=Product)
+def push_stock(sender, instance, **kwargs):
+    #the hub drops it when nobody is subscribed or the stock did not change
+    push.publish(
+        push.product_topic(instance.pk), 'product', {
+            'id': instance.pk,
+            'stock': instance.stock,
+            'is_in_stock': instance.is_in_stock,
+        })
+
+
+@receiver(post_save, sender=Order)
+def push_order_status(sender, instance, **kwargs):
+    push.publish(push.orders_topic(instance.user_id), 'order', {
+        'order_id': str(instance.order_id),
+        'status': instance.status,
+    })
+
+
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+def invalidate_order_cache(sender, instance, **kwargs):
+    bump_generation('order_list')
+
+
+@receiver(post_save, sender=Order)
+def queue_order_side_effects(sender, instance, created, **kwargs):
+    #runs in the worker after the order (and its items) are committed, not inside the request
+    if created:
+        enqueue('send_order_confirmation',
+                str(instance.order_id),
+                idempotency_key=f'order-confirmation:{instance.order_id}')
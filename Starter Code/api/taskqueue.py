@@ -0,0 +1,143 @@
+"""
+A small database-backed task queue.
+
+    @task('send_order_confirmation')
+    def send_order_confirmation(order_id): ...
+
+    enqueue('send_order_confirmation', order_id, idempotency_key=f'order-confirmation:{order_id}')
+
+Tasks are only written to the queue when the surrounding transaction commits,
+and are executed by `python manage.py run_worker`.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.models import Task
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name):
+    """
+    Registers a function under a name the queue can refer to.
+    """
+
+    def decorator(func):
+        _registry[name] = func
+        return func
+
+    return decorator
+
+
+def get_task(name):
+    return _registry[name]
+
+
+def enqueue(name,
+            *args,
+            idempotency_key=None,
+            delay=0,
+            max_attempts=5,
+            **kwargs):
+    """
+    Queue a task once the current transaction commits (immediately outside a transaction).
+    If the transaction rolls back nothing is queued, so a task never sees data that does not exist.
+    """
+    if name not in _registry:
+        raise KeyError(f"Unknown task '{name}'")
+
+    def push():
+        eager = settings.TASK_QUEUE_EAGER
+        try:
+            with transaction.atomic():
+                #an eager task is claimed as it is written, so no worker can pick it up as well
+                new_task = Task.objects.create(
+                    name=name,
+                    args=list(args),
+                    kwargs=kwargs,
+                    idempotency_key=idempotency_key,
+                    max_attempts=max_attempts,
+                    run_at=timezone.now() + timedelta(seconds=delay),
+                    status=Task.StatusChoices.RUNNING
+                    if eager else Task.StatusChoices.QUEUED,
+                    attempts=1 if eager else 0,
+                )
+        except IntegrityError:
+            #a task with this idempotency key was already queued
+            return
+        if eager:
+            run(new_task)
+
+    transaction.on_commit(push)
+
+
+def claim_next():
+    """
+    Takes the next due task and marks it as running.
+    The conditional UPDATE makes sure two workers never claim the same task,
+    it works the same on SQLite (no SELECT ... FOR UPDATE SKIP LOCKED there).
+    """
+    now = timezone.now()
+    candidates = Task.objects.filter(
+        status=Task.StatusChoices.QUEUED,
+        run_at__lte=now).order_by('run_at').values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        still_queued = Task.objects.filter(pk=pk,
+                                           status=Task.StatusChoices.QUEUED)
+        claimed = still_queued.update(status=Task.StatusChoices.RUNNING,
+                                      attempts=F('attempts') + 1,
+                                      updated_at=now)
+        if claimed:
+            return Task.objects.get(pk=pk)
+    return None
+
+
+def backoff(attempts):
+    """
+    Exponential backoff with jitter: ~2s, 4s, 8s ... capped at TASK_QUEUE_MAX_BACKOFF.
+    """
+    delay = min(settings.TASK_QUEUE_BASE_BACKOFF * 2**(attempts - 1),
+                settings.TASK_QUEUE_MAX_BACKOFF)
+    return delay * random.uniform(0.5, 1)
+
+
+def run(current):
+    """
+    Executes a claimed task and records the outcome, scheduling a retry on failure.
+    """
+    try:
+        get_task(current.name)(*current.args, **current.kwargs)
+    except Exception:
+        current.last_error = traceback.format_exc()
+        if current.attempts < current.max_attempts:
+            current.status = Task.StatusChoices.QUEUED
+            current.run_at = timezone.now() + timedelta(
+                seconds=backoff(current.attempts))
+        else:
+            current.status = Task.StatusChoices.FAILED
+        logger.exception('Task %s failed (attempt %s/%s)', current.name,
+                         current.attempts, current.max_attempts)
+    else:
+        current.status = Task.StatusChoices.DONE
+        current.last_error = ''
+    current.save()
+    return current
+
+
+def requeue_stale(older_than):
+    """
+    Puts back tasks left in RUNNING by a worker that died.
+    """
+    cutoff = timezone.now() - older_than
+    stale = Task.objects.filter(status=Task.StatusChoices.RUNNING,
+                                updated_at__lt=cutoff)
+    return stale.update(status=Task.StatusChoices.QUEUED)
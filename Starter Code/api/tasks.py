@@ -0,0 +1,21 @@
+from django.core.mail import send_mail
+
+from api.models import Order
+from api.taskqueue import task
+
+
+@task('send_order_confirmation')
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').prefetch_related('items').get(
+        pk=order_id)
+    if not order.user.email:
+        return
+    lines = [
+        f"{item.quantity} x {item.product_name}" for item in order.items.all()
+    ]
+    send_mail(
+        subject=f"Order {order.order_id} received",
+        message="Thanks for your order!\n\n" + "\n".join(lines),
+        from_email=None,
+        recipient_list=[order.user.email],
+    )
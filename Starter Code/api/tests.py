@@ -1,9 +1,81 @@
-from django.test import TestCase
-from api.models import Order, User
+import asyncio
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.signals import request_started
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.utils import timezone
+from api.archive import archive_orders
+from api.changefeed import compact_log
+from api.models import (ArchivedOrder, ArchivedOrderItem, Order, OrderItem,
+                        Product, ProductChange, Task, User)
+from api.querybudget import QueryBudgetExceeded, fingerprint, inspect_queries
+from api.serializers import UserSerializer
+from api import compression, push, routers, schema, taskqueue, throttling, warmup
+from api.cache import (bump_generation, get_generation, get_or_rebuild,
+                       response_cache_key)
+from api.views import OrderViewSet
+from drf_course.settings import database_settings
 from rest_framework import status
+from rest_framework.mixins import ListModelMixin
 from django.urls import reverse
 # Create your tests here.
 
+#The tests don't need a running Redis server
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    }
+}
+
+
+class ApiTestMixin:
+    """
+    Every test starts with an empty cache and full throttle buckets,
+    and with self.user (password 'test') when the class sets a username.
+    """
+    username = None
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        throttling._local_buckets.clear()
+        if self.username is not None:
+            self.user = User.objects.create_user(username=self.username,
+                                                 password='test')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApiTestCase(ApiTestMixin, TestCase):
+    pass
+
+
+#for tests that need real commits (threads, on_commit, async views)
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApiTransactionTestCase(ApiTestMixin, TransactionTestCase):
+    pass
+
 
 class UserOrderTestCase(TestCase):
     """
@@ -38,3 +110,1384 @@ class UserOrderTestCase(TestCase):
     def test_user_order_list_unauthenticated(self):
         response = self.client.get(reverse('user-orders'))
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@mock.patch('api.routers.replica_configured', return_value=True)
+class PrimaryReplicaRouterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_reads_go_to_replica(self, _):
+        self.assertEqual(self.router.db_for_read(Product), 'replica')
+        self.assertEqual(self.router.db_for_read(Order), 'replica')
+        #models that are not routed (users, sessions...) stay on the primary
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_reads_after_write_stay_on_primary(self, _):
+        self.assertEqual(self.router.db_for_write(Order), 'default')
+        self.assertIsNone(self.router.db_for_read(Order))
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_on_primary_restores_the_previous_pin(self, _):
+        with routers.on_primary():
+            with routers.on_primary():
+                self.assertIsNone(self.router.db_for_read(Order))
+            #the inner block does not unpin the outer one
+            self.assertIsNone(self.router.db_for_read(Order))
+        self.assertEqual(self.router.db_for_read(Order), 'replica')
+
+    def test_worker_does_not_stay_pinned_after_a_task(self, _):
+        reads = []
+
+        def run(current):
+            reads.append(self.router.db_for_read(Order))
+            #the task writes, which pins the thread
+            self.router.db_for_write(Order)
+            return current
+
+        with mock.patch.object(taskqueue, 'requeue_stale', return_value=0), \
+                mock.patch.object(taskqueue, 'claim_next',
+                                  side_effect=[Task(name='a'),
+                                               Task(name='b'), None]), \
+                mock.patch.object(taskqueue, 'run', run):
+            call_command('run_worker', once=True, stdout=StringIO())
+        #tasks read from the primary, and their writes do not pin the worker afterwards
+        self.assertEqual(reads, [None, None])
+        self.assertEqual(self.router.db_for_read(Order), 'replica')
+
+    def test_replica_is_never_migrated(self, _):
+        self.assertFalse(self.router.allow_migrate('replica', 'api'))
+        self.assertTrue(self.router.allow_migrate('default', 'api'))
+
+
+@mock.patch('api.routers.replica_configured', return_value=True)
+class ReadYourWritesTestCase(ApiTransactionTestCase):
+    username = 'user1'
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Watch',
+                                              price='500.05',
+                                              stock=3)
+        #the "replica": a second connection to the same test database
+        primary = connections['default']
+        connections['replica'] = primary.__class__(primary.settings_dict,
+                                                   alias='replica')
+        self.addCleanup(delattr, connections._connections, 'replica')
+        self.addCleanup(connections['replica'].close)
+        self.client.force_login(self.user)
+
+    def order_reads(self, url):
+        """
+        The database each SELECT on the orders table of the request went to.
+        """
+        aliases = []
+
+        def record(alias):
+
+            def wrapper(execute, sql, params, many, context):
+                if sql.startswith('SELECT') and 'FROM "api_order"' in sql:
+                    aliases.append(alias)
+                return execute(sql, params, many, context)
+
+            return wrapper
+
+        with connections['default'].execute_wrapper(record('default')), \
+                connections['replica'].execute_wrapper(record('replica')):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return aliases
+
+    def test_reads_follow_the_users_own_write(self, _):
+        response = self.client.post(
+            '/orders/', {
+                'status': 'Pending',
+                'items': [{
+                    'product': self.product.pk,
+                    'quantity': 1
+                }],
+            },
+            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = f"/orders/{response.json()['order_id']}/"
+
+        #within REPLICA_PIN_SECONDS the next request reads the new order from the primary
+        self.assertEqual(self.order_reads(url), ['default'])
+        later = time.time() + settings.REPLICA_PIN_SECONDS + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(self.order_reads(url), ['replica'])
+
+
+class SqlitePragmasCommandTestCase(TestCase):
+
+    def test_reports_every_configured_pragma(self):
+        out = StringIO()
+        call_command('sqlite_pragmas', stdout=out)
+        for name in ('journal_mode', 'synchronous', 'mmap_size', 'cache_size',
+                     'busy_timeout'):
+            self.assertIn(f'{name}:', out.getvalue())
+
+    def test_tuning_is_applied_on_a_fresh_connection(self):
+        #the test database lives in memory (no WAL there), so a file with the production options
+        default = connections['default']
+        with tempfile.TemporaryDirectory() as directory:
+            tuned = default.__class__(
+                {
+                    **default.settings_dict,
+                    **database_settings(debug=False)['default'],
+                    'NAME':
+                    os.path.join(directory, 'tuned.sqlite3'),
+                },
+                alias='tuned')
+            connections['tuned'] = tuned
+            try:
+                out = StringIO()
+                call_command('sqlite_pragmas', database='tuned', stdout=out)
+                with tuned.cursor() as cursor:
+                    applied = {
+                        name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                        for name in ('journal_mode', 'busy_timeout',
+                                     'synchronous')
+                    }
+            finally:
+                tuned.close()
+                del connections['tuned']
+        self.assertEqual(
+            applied,
+            {
+                'journal_mode': 'wal',
+                'busy_timeout': settings.SQLITE_PRAGMAS['busy_timeout'],
+                #NORMAL
+                'synchronous': 1,
+            })
+        self.assertIn('tuning mode: on', out.getvalue())
+        self.assertIn('transaction mode: IMMEDIATE', out.getvalue())
+        self.assertIn('journal_mode: wal (configured WAL)', out.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SingleFlightCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.rebuilds = 0
+        self.lock = threading.Lock()
+
+    def slow_rebuild(self, value):
+
+        def rebuild():
+            with self.lock:
+                self.rebuilds += 1
+            time.sleep(0.2)
+            return value
+
+        return rebuild
+
+    def fire(self, key, value, workers=20):
+        results = []
+        generation = get_generation('test')
+
+        def worker():
+            results.append(
+                get_or_rebuild(key,
+                               self.slow_rebuild(value),
+                               timeout=60,
+                               generation=generation))
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_misses_rebuild_once_per_key(self):
+        results = self.fire('test:a', 'page a') + self.fire('test:b', 'page b')
+        self.assertEqual(self.rebuilds, 2)
+        self.assertEqual(results.count('page a'), 20)
+        self.assertEqual(results.count('page b'), 20)
+
+    def test_stale_value_is_served_while_one_worker_rebuilds(self):
+        self.fire('test:a', 'old')
+        bump_generation('test')
+        self.rebuilds = 0
+        results = self.fire('test:a', 'new')
+        self.assertEqual(self.rebuilds, 1)
+        #only the worker doing the rebuild waited for the new value
+        self.assertEqual(results.count('new'), 1)
+        self.assertEqual(results.count('old'), 19)
+
+    def test_cold_miss_waits_briefly_for_a_slow_rebuild(self):
+        #another worker holds the lock and is stuck rebuilding
+        cache.add('test:a:lock', 1, 10)
+        started = time.time()
+        value = get_or_rebuild('test:a',
+                               self.slow_rebuild('page a'),
+                               timeout=60,
+                               generation=get_generation('test'),
+                               wait_timeout=0.1)
+        self.assertEqual(value, 'page a')
+        self.assertLess(time.time() - started, 1)
+
+
+#ProductListCreateAPIView.get_queryset sleeps on purpose, counting the sleeps counts the rebuilds
+@mock.patch('time.sleep')
+class ProductListCacheTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(name='Coffee Machine', price='70.99', stock=6)
+
+    def test_list_is_cached_until_a_product_changes(self, sleep):
+        self.assertEqual(self.client.get('/products/').json()['count'], 1)
+        self.assertEqual(self.client.get('/products/').json()['count'], 1)
+        #get_queryset (the expensive part) only ran for the first request
+        self.assertEqual(sleep.call_count, 1)
+
+        Product.objects.create(name='Watch', price='500.05', stock=3)
+        self.assertEqual(self.client.get('/products/').json()['count'], 2)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_only_successful_responses_are_cached(self, sleep):
+        busy = Response({'detail': 'Try again later.'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        with mock.patch.object(ListModelMixin, 'list', return_value=busy):
+            response = self.client.get('/products/')
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        #the error was not stored, the next request builds the page
+        self.assertEqual(self.client.get('/products/').json()['count'], 1)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_hits_keep_the_response_headers(self, sleep):
+        list_products = ListModelMixin.list
+
+        def linked_list(view, request, *args, **kwargs):
+            response = list_products(view, request, *args, **kwargs)
+            response['Link'] = '</products/?pagenum=2>; rel="next"'
+            return response
+
+        with mock.patch.object(ListModelMixin, 'list', linked_list):
+            miss = self.client.get('/products/')
+            hit = self.client.get('/products/')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(hit['Link'], '</products/?pagenum=2>; rel="next"')
+        self.assertEqual(dict(hit.items()), dict(miss.items()))
+
+
+def tiered_caches(location):
+    return {
+        'default': {
+            'BACKEND': 'api.cache_backends.TieredCache',
+            'LOCATION': location,
+            'OPTIONS': {
+                'SHARED_ALIAS': 'shared',
+                'EPOCH_CHECK_INTERVAL': 0,
+            },
+        },
+        #a second process with its own local tier
+        'other_process': {
+            'BACKEND': 'api.cache_backends.TieredCache',
+            'LOCATION': f'{location}-other',
+            'OPTIONS': {
+                'SHARED_ALIAS': 'shared',
+                'EPOCH_CHECK_INTERVAL': 0,
+            },
+        },
+        #stands in for Redis
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': f'{location}-shared',
+        },
+    }
+
+
+class TieredCacheTestCase(SimpleTestCase):
+
+    def test_hits_are_served_from_the_local_tier(self):
+        with override_settings(CACHES=tiered_caches('hits')):
+            cache.set('product_list:page', 'page 1')
+            caches['shared'].set('product_list:page',
+                                 'changed behind our back')
+            self.assertEqual(cache.get('product_list:page'), 'page 1')
+            self.assertEqual(caches['other_process'].get('product_list:page'),
+                             'changed behind our back')
+            self.assertIsNone(cache.get('missing'))
+
+            cache._sync()
+            caches['other_process']._sync()
+            stats = cache.stats()
+            self.assertEqual(stats['local']['count'], 1)
+            self.assertEqual(stats['shared']['count'], 1)
+            self.assertEqual(stats['miss']['count'], 1)
+
+    def test_invalidation_reaches_other_processes(self):
+        with override_settings(CACHES=tiered_caches('invalidation')):
+            other = caches['other_process']
+            self.assertEqual(get_generation('product_list'), 1)
+            self.assertEqual(other.get('product_list:generation'), 1)
+
+            bump_generation('product_list')
+            self.assertEqual(other.get('product_list:generation'), 2)
+
+    def test_invalidation_drops_only_the_invalidated_key(self):
+        with override_settings(CACHES=tiered_caches('per-key')):
+            other = caches['other_process']
+            cache.set('product_list:page', 'page 1')
+            cache.set('product:1', 'watch')
+            self.assertEqual(other.get('product_list:page'), 'page 1')
+            self.assertEqual(other.get('product:1'), 'watch')
+            caches['shared'].set('product_list:page',
+                                 'changed behind our back')
+            caches['shared'].set('product:1', 'changed behind our back')
+
+            cache.delete('product:1')
+            self.assertIsNone(other.get('product:1'))
+            #the rest of the other process' local tier survives
+            self.assertEqual(other.get('product_list:page'), 'page 1')
+
+            cache.clear()
+            self.assertIsNone(other.get('product_list:page'))
+
+    def test_rebuild_once_when_a_process_has_a_stale_local_copy(self):
+        with override_settings(CACHES=tiered_caches('single-flight')):
+            builds = []
+
+            def run(process, name):
+                with mock.patch('api.cache.cache', process):
+                    return get_or_rebuild(
+                        'product_list:page',
+                        lambda: builds.append(name) or name,
+                        60,
+                        generation=get_generation('product_list'),
+                        beta=0)
+
+            self.assertEqual(run(cache, 'a1'), 'a1')
+            bump_generation('product_list')
+            #the other process rebuilds first; ours still has 'a1' in its local tier
+            self.assertEqual(run(caches['other_process'], 'b2'), 'b2')
+            self.assertEqual(run(cache, 'a3'), 'b2')
+            self.assertEqual(builds, ['a1', 'b2'])
+
+
+@taskqueue.task('test_flaky')
+def flaky_task(fail):
+    if fail:
+        raise RuntimeError('downstream is down')
+
+
+class TaskQueueTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='buyer',
+                                             email='buyer@example.com',
+                                             password='test')
+        self.product = Product.objects.create(name='Watch',
+                                              price='500.05',
+                                              stock=3)
+
+    def test_order_creation_queues_confirmation_after_commit(self):
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/orders/', {
+                    'status': 'Pending',
+                    'items': [{
+                        'product': self.product.pk,
+                        'quantity': 2
+                    }],
+                },
+                content_type='application/json')
+            #nothing is queued until the request's transaction commits
+            self.assertFalse(Task.objects.exists())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Task.objects.get().name, 'send_order_confirmation')
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('run_worker', once=True, stdout=StringIO())
+        self.assertEqual(Task.objects.get().status, Task.StatusChoices.DONE)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('2 x Watch', mail.outbox[0].body)
+
+    def test_idempotency_key_queues_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue('test_flaky', False, idempotency_key='once')
+            taskqueue.enqueue('test_flaky', False, idempotency_key='once')
+        self.assertEqual(
+            Task.objects.filter(idempotency_key='once').count(), 1)
+
+    def test_failed_task_is_retried_with_backoff_then_given_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue('test_flaky', True, max_attempts=2)
+
+        current = taskqueue.run(taskqueue.claim_next())
+        self.assertEqual(current.status, Task.StatusChoices.QUEUED)
+        self.assertGreater(current.run_at, current.updated_at)
+        #not due yet
+        self.assertIsNone(taskqueue.claim_next())
+
+        Task.objects.update(run_at=current.created_at)
+        current = taskqueue.run(taskqueue.claim_next())
+        self.assertEqual(current.status, Task.StatusChoices.FAILED)
+        self.assertEqual(current.attempts, 2)
+        self.assertIn('downstream is down', current.last_error)
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_eager_task_cannot_be_claimed_by_a_worker(self):
+        claimed = []
+
+        @taskqueue.task('test_claim_during_run')
+        def claim_during_run():
+            claimed.append(taskqueue.claim_next())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.enqueue('test_claim_during_run')
+        self.assertEqual(claimed, [None])
+        current = Task.objects.get()
+        self.assertEqual(current.status, Task.StatusChoices.DONE)
+        self.assertEqual(current.attempts, 1)
+
+
+class TokenBucketThrottleTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Watch',
+                                              price='500.05',
+                                              stock=3)
+
+    def tearDown(self):
+        throttling._local_buckets.clear()
+
+    def test_bucket_refills_over_time(self):
+        for _ in range(3):
+            self.assertTrue(throttling.take_token_local('k', 3, 1)[0])
+        allowed, wait = throttling.take_token_local('k', 3, 1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1, places=1)
+
+        bucket = throttling._local_buckets['k']
+        throttling._local_buckets['k'] = (bucket[0], bucket[1] - 1)
+        self.assertTrue(throttling.take_token_local('k', 3, 1)[0])
+
+    @mock.patch.object(throttling, 'LOCAL_MAX_BUCKETS', 2)
+    def test_full_local_store_forgets_the_least_recent_client(self):
+        self.assertTrue(throttling.take_token_local('busy', 1, 0.01)[0])
+        self.assertTrue(throttling.take_token_local('idle', 1, 0.01)[0])
+        self.assertFalse(throttling.take_token_local('busy', 1, 0.01)[0])
+        self.assertTrue(throttling.take_token_local('new', 1, 0.01)[0])
+        #only the idle client made room, the busy one is still limited
+        self.assertEqual(list(throttling._local_buckets), ['busy', 'new'])
+        self.assertFalse(throttling.take_token_local('busy', 1, 0.01)[0])
+
+    def test_anonymous_browsing_is_limited_per_ip(self):
+        rates = {'products': '2/min', 'order_create': '10/min'}
+        with mock.patch.dict(throttling.api_settings.DEFAULT_THROTTLE_RATES,
+                             rates):
+            url = f'/products/{self.product.pk}/'
+            for _ in range(2):
+                self.assertEqual(
+                    self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code,
+                    status.HTTP_200_OK)
+            response = self.client.get(url, REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', response)
+            #another client still has its own budget
+            self.assertEqual(
+                self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code,
+                status.HTTP_200_OK)
+
+    def test_staff_writes_are_not_browsing(self):
+        admin = User.objects.create_superuser(username='admin',
+                                              password='test')
+        self.client.force_login(admin)
+        rates = {'products': '1/min', 'order_create': '10/min'}
+        with mock.patch.dict(throttling.api_settings.DEFAULT_THROTTLE_RATES,
+                             rates):
+            for i in range(3):
+                response = self.client.post(
+                    '/products/', {
+                        'name': f'Watch {i}',
+                        'description': '',
+                        'price': '10.00',
+                        'stock': 1,
+                    })
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_staff_edits_do_not_use_the_browse_budget(self):
+        admin = User.objects.create_superuser(username='admin',
+                                              password='test')
+        self.client.force_login(admin)
+        product = Product.objects.create(name='Watch', price='10.00', stock=1)
+        rates = {'products': '1/min', 'order_create': '10/min'}
+        with mock.patch.dict(throttling.api_settings.DEFAULT_THROTTLE_RATES,
+                             rates):
+            for stock in range(3):
+                response = self.client.patch(f'/products/{product.pk}/',
+                                             {'stock': stock},
+                                             content_type='application/json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            #the one browse token is still there
+            response = self.client.get(f'/products/{product.pk}/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(f'/products/{product.pk}/')
+            self.assertEqual(response.status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+            #and an empty budget does not stop staff either
+            response = self.client.delete(f'/products/{product.pk}/')
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class IdempotencyKeyTestCase(ApiTransactionTestCase):
+    username = 'mobile'
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Watch',
+                                              price='500.05',
+                                              stock=3)
+        self.view = OrderViewSet.as_view({'post': 'create'})
+
+    def post(self, key, quantity=1):
+        request = APIRequestFactory().post(
+            '/orders/', {
+                'status': 'Pending',
+                'items': [{
+                    'product': self.product.pk,
+                    'quantity': quantity
+                }],
+            },
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_parallel_duplicates_create_one_order(self):
+        responses = []
+
+        def retry():
+            responses.append(self.post('retry-1'))
+            connection.close()
+
+        threads = [threading.Thread(target=retry) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertTrue(
+            all(r.status_code == status.HTTP_201_CREATED for r in responses))
+        self.assertEqual(len({r.data['order_id'] for r in responses}), 1)
+        replayed = [
+            r for r in responses if r.has_header('Idempotent-Replayed')
+        ]
+        self.assertEqual(len(replayed), 7)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.assertEqual(
+            self.post('retry-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            self.post('retry-2', quantity=2).status_code,
+            status.HTTP_422_UNPROCESSABLE_ENTITY)
+        #a new key is a new order
+        self.assertEqual(
+            self.post('retry-3').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class SparseFieldsetsTestCase(ApiTestCase):
+    username = 'grid'
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Watch',
+                                              description='long ' * 1000,
+                                              price='500.05',
+                                              stock=3)
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2)
+        self.client.force_login(self.user)
+
+    def api_queries(self, url, table):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        #only the reads of one table, leaves out silk's and the session's queries
+        queries = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and f'FROM "{table}"' in q['sql']
+        ]
+        return response, queries
+
+    def test_product_fields_are_pruned_down_to_sql(self):
+        response, queries = self.api_queries(
+            f'/products/{self.product.pk}/?fields=name,price', 'api_product')
+        self.assertEqual(response.json(), {'name': 'Watch', 'price': '500.05'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0])
+
+        response = self.client.get(
+            f'/products/{self.product.pk}/?exclude=description')
+        self.assertEqual(set(response.json()), {'name', 'price', 'stock'})
+
+    def test_orders_skip_items_prefetch_unless_requested(self):
+        response, queries = self.api_queries('/orders/?fields=order_id,status',
+                                             'api_orderitem')
+        self.assertEqual(set(response.json()[0]), {'order_id', 'status'})
+        self.assertEqual(queries, [])
+
+        cache.clear()
+        response = self.client.get('/orders/?fields=order_id,items.quantity')
+        self.assertEqual(response.json()[0]['items'], [{'quantity': 2}])
+
+    def test_field_order_does_not_change_the_cache_key(self):
+        factory = APIRequestFactory()
+        keys = set()
+        for fields in ('name,price', 'price,name', 'price, name'):
+            request = Request(factory.get('/products/', {'fields': fields}))
+            request.accepted_renderer = mock.Mock(format='json')
+            keys.add(response_cache_key('product_list', request))
+        self.assertEqual(len(keys), 1)
+
+
+class QueryBudgetTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        product = Product.objects.create(name='Watch', price='500.05', stock=3)
+        for i in range(4):
+            user = User.objects.create_user(username=f'user{i}',
+                                            password='test')
+            order = Order.objects.create(user=user)
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        self.user = user
+
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 12 AND name = 'x''y'"),
+            fingerprint("SELECT * FROM t WHERE id = 7 AND name = 'z'"))
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (?, ?, ?)'),
+                         'SELECT * FROM t WHERE id IN (...)')
+
+    def test_n_plus_one_is_reported_with_its_serializer_field(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded,
+                                      'UserSerializer.orders'):
+            with inspect_queries():
+                UserSerializer(User.objects.all(), many=True).data
+
+        with inspect_queries(budget=2):
+            UserSerializer(User.objects.prefetch_related('orders'),
+                           many=True).data
+
+    def test_view_over_its_budget_fails_in_tests(self):
+        self.client.force_login(self.user)
+        self.assertEqual(
+            self.client.get('/users/').status_code, status.HTTP_200_OK)
+        with mock.patch.object(OrderViewSet, 'query_budget', {'list': 1}):
+            with self.assertRaisesMessage(QueryBudgetExceeded,
+                                          'the budget is 1'):
+                self.client.get('/orders/')
+
+
+class ApiSettingsProfileTestCase(SimpleTestCase):
+
+    def test_api_profile_drops_dev_only_apps_and_middleware(self):
+        from drf_course import settings_api
+
+        for app in ('django.contrib.admin', 'django.contrib.sessions',
+                    'django_extensions', 'silk', 'drf_spectacular'):
+            self.assertNotIn(app, settings_api.INSTALLED_APPS)
+        self.assertNotIn('silk.middleware.SilkyMiddleware',
+                         settings_api.MIDDLEWARE)
+        self.assertIn('api', settings_api.INSTALLED_APPS)
+
+    def test_api_profile_boots_without_dev_only_modules(self):
+        #a fresh interpreter, the test process already imported everything
+        code = (
+            'import sys, drf_course.wsgi; '
+            "print(sorted(m for m in ('silk', 'drf_spectacular', 'django_extensions') "
+            'if m in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=settings.BASE_DIR,
+                                env={
+                                    **os.environ, 'DJANGO_SETTINGS_MODULE':
+                                    'drf_course.settings_api'
+                                },
+                                capture_output=True,
+                                text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_api_profile_derives_production_defaults(self):
+        #what settings.py derived from DEBUG=True must follow the profile's DEBUG=False
+        code = (
+            'import django, json; django.setup(); '
+            'from django.conf import settings; from django.urls import resolve; '
+            "db = settings.DATABASES['default']; "
+            "print(json.dumps([db['CONN_MAX_AGE'], db['OPTIONS'].get('transaction_mode'), "
+            "settings.OPENAPI_SCHEMA_PRECOMPUTED, resolve('/api/schema/').url_name]))"
+        )
+        env = {
+            name: value
+            for name, value in os.environ.items()
+            if name not in ('DJANGO_DEBUG', 'DB_CONN_MAX_AGE', 'SQLITE_TUNING',
+                            'OPENAPI_SCHEMA_PRECOMPUTED')
+        }
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=settings.BASE_DIR,
+                                env={
+                                    **env, 'DJANGO_SETTINGS_MODULE':
+                                    'drf_course.settings_api'
+                                },
+                                capture_output=True,
+                                text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout),
+                         [60, 'IMMEDIATE', True, 'schema'])
+
+
+class SchemaDriftTestCase(TestCase):
+
+    def setUp(self):
+        from drf_spectacular.drainage import GENERATOR_STATS
+
+        #the generator's warnings are for `manage.py spectacular`, not the test output
+        self.enterContext(GENERATOR_STATS.silence())
+        schema.load_schema.cache_clear()
+        self.addCleanup(schema.load_schema.cache_clear)
+
+    def test_checked_in_schema_matches_the_code(self):
+        with open(settings.OPENAPI_SCHEMA_FILE, 'rb') as f:
+            checked_in = f.read()
+        self.assertEqual(
+            checked_in, schema.generate_schema(),
+            'schema.yml is out of date, run `python manage.py spectacular --file schema.yml`'
+        )
+
+    @override_settings(OPENAPI_SCHEMA_PRECOMPUTED=True)
+    def test_served_schema_is_the_generated_one(self):
+        response = self.client.get('/api/schema/')
+        self.assertEqual(response.content, schema.generate_schema())
+
+        compressed = self.client.get('/api/schema/?format=json',
+                                     HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('paths', json.loads(gzip.decompress(compressed.content)))
+
+    @override_settings(OPENAPI_SCHEMA_PRECOMPUTED=True)
+    def test_etag_revalidation(self):
+        response = self.client.get('/api/schema/')
+        not_modified = self.client.get('/api/schema/',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+
+class OrderArchiveTestCase(ApiTestCase):
+    username = 'user1'
+
+    def setUp(self):
+        super().setUp()
+        product = Product.objects.create(name='Watch', price='500.05', stock=3)
+        self.old = Order.objects.create(user=self.user,
+                                        status=Order.StatusChoices.CONFIRMED)
+        self.old_pending = Order.objects.create(user=self.user)
+        self.recent = Order.objects.create(
+            user=self.user, status=Order.StatusChoices.CONFIRMED)
+        for order in (self.old, self.old_pending, self.recent):
+            OrderItem.objects.create(order=order, product=product, quantity=2)
+        Order.objects.filter(pk__in=[self.old.pk, self.old_pending.pk]).update(
+            created_at=timezone.now() - timedelta(days=365))
+
+    def test_only_old_finished_orders_are_archived(self):
+        self.assertEqual(archive_orders(days=90, batch_size=1), 1)
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)),
+                         {self.old_pending.pk, self.recent.pk})
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual(archived.pk, self.old.pk)
+        self.assertEqual(archived.items.get().quantity, 2)
+        self.assertFalse(
+            OrderItem.objects.filter(order_id=self.old.pk).exists())
+
+    def test_order_changed_during_the_copy_stays_live(self):
+        copy_items = ArchivedOrderItem.objects.bulk_create
+
+        def reopen_then_copy(items):
+            #another writer (without row locks, e.g. SQLite) reopens the order mid-batch
+            Order.objects.filter(pk=self.old.pk).update(
+                status=Order.StatusChoices.PENDING)
+            return copy_items(items)
+
+        with mock.patch.object(ArchivedOrderItem.objects, 'bulk_create',
+                               reopen_then_copy):
+            self.assertEqual(archive_orders(days=90, batch_size=100), 0)
+        self.assertTrue(Order.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(OrderItem.objects.filter(order=self.old).count(), 1)
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertFalse(ArchivedOrderItem.objects.exists())
+
+    def test_one_invalidation_per_batch(self):
+        product = Product.objects.get()
+        for _ in range(3):
+            order = Order.objects.create(user=self.user,
+                                         status=Order.StatusChoices.CONFIRMED)
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        Order.objects.filter(status=Order.StatusChoices.CONFIRMED).exclude(
+            pk=self.recent.pk).update(created_at=timezone.now() -
+                                      timedelta(days=365))
+        before = get_generation('order_list')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_orders(days=90, batch_size=2), 4)
+        #two batches of two orders with an item each, not one bump per deleted row
+        self.assertEqual(get_generation('order_list'), before + 2)
+
+    def test_archived_order_can_still_be_retrieved(self):
+        self.client.force_login(self.user)
+        live = self.client.get(f'/orders/{self.old.pk}/').json()
+        archive_orders(days=90, batch_size=100)
+
+        response = self.client.get(f'/orders/{self.old.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), live)
+
+        other = User.objects.create_user(username='user2', password='test')
+        self.client.force_login(other)
+        response = self.client.get(f'/orders/{self.old.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductBatchTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price='10.00', stock=i)
+            for i in range(3)
+        ]
+
+    def product_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        #only the reads of the product table, leaves out silk's queries
+        return response.json(), [
+            q for q in queries.captured_queries if
+            q['sql'].startswith('SELECT') and 'FROM "api_product"' in q['sql']
+        ]
+
+    def test_keeps_the_requested_order_and_reports_missing_ids(self):
+        first, _, third = self.products
+        response = self.client.get(
+            f'/products/batch?ids={third.pk},{first.pk},999,{third.pk}')
+        body = response.json()
+        self.assertEqual([p['id'] for p in body['products']],
+                         [third.pk, first.pk])
+        self.assertEqual(body['products'][0]['name'], 'Product 2')
+        self.assertEqual(body['missing'], [999])
+
+    def test_one_query_then_served_from_the_cache(self):
+        url = '/products/batch?ids=' + ','.join(
+            str(p.pk) for p in self.products)
+        _, queries = self.product_queries(url)
+        self.assertEqual(len(queries), 1)
+        _, queries = self.product_queries(url)
+        self.assertEqual(len(queries), 0)
+
+        #saving a product drops its cache entry
+        self.products[1].price = '12.50'
+        self.products[1].save()
+        body, queries = self.product_queries(url)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(body['products'][1]['price'], '12.50')
+
+    def test_invalid_and_too_many_ids_are_rejected(self):
+        self.assertEqual(
+            self.client.get('/products/batch?ids=1,abc').status_code,
+            status.HTTP_400_BAD_REQUEST)
+        ids = ','.join(str(i) for i in range(1, 102))
+        self.assertEqual(
+            self.client.get(f'/products/batch?ids={ids}').status_code,
+            status.HTTP_400_BAD_REQUEST)
+        #larger than the primary key column, the database driver would overflow
+        self.assertEqual(
+            self.client.get(
+                '/products/batch?ids=99999999999999999999999').status_code,
+            status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.post('/products/batch',
+                             '"1"',
+                             content_type='application/json').status_code,
+            status.HTTP_400_BAD_REQUEST)
+
+    def test_post_accepts_a_list_of_ids(self):
+        first = self.products[0]
+        response = self.client.post('/products/batch', [first.pk, 999],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['missing'], [999])
+
+
+@override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=0)
+class ProductChangeFeedTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.watch, self.phone, self.tv = [
+            Product.objects.create(name=name, price='10.00', stock=1)
+            for name in ('Watch', 'Phone', 'TV')
+        ]
+
+    def sync(self, since, limit=100):
+        response = self.client.get(
+            f'/products/changes?since={since}&limit={limit}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_full_sync_then_only_what_changed(self):
+        full = self.sync(0)
+        self.assertEqual([c['id'] for c in full['changes']],
+                         [self.watch.pk, self.phone.pk, self.tv.pk])
+        self.assertFalse(full['has_more'])
+
+        self.watch.price = '12.00'
+        self.watch.save()
+        self.watch.save()
+        phone_id = self.phone.pk
+        self.phone.delete()
+        changed = self.sync(full['next'])
+        self.assertEqual(changed['changes'], [
+            {
+                'id': self.watch.pk,
+                'action': 'upsert',
+                'product': {
+                    'id': self.watch.pk,
+                    'name': 'Watch',
+                    'description': '',
+                    'price': '12.00',
+                    'stock': 1,
+                },
+            },
+            {
+                'id': phone_id,
+                'action': 'delete'
+            },
+        ])
+        self.assertEqual(self.sync(changed['next'])['changes'], [])
+
+    def test_pages_only_hold_the_latest_change_per_product(self):
+        for _ in range(3):
+            self.watch.save()
+        page = self.sync(0, limit=2)
+        self.assertEqual([c['id'] for c in page['changes']],
+                         [self.phone.pk, self.tv.pk])
+        self.assertTrue(page['has_more'])
+        page = self.sync(page['next'], limit=2)
+        self.assertEqual([c['id'] for c in page['changes']], [self.watch.pk])
+        self.assertFalse(page['has_more'])
+
+    def test_compacting_the_log_does_not_change_any_sync(self):
+        for _ in range(3):
+            self.watch.save()
+        self.phone.delete()
+        tokens = range(ProductChange.objects.latest('pk').pk + 1)
+        before = [self.sync(token) for token in tokens]
+        #3 older saves of the watch, the creation of the phone
+        self.assertEqual(compact_log(), 4)
+        self.assertEqual([self.sync(token) for token in tokens], before)
+
+
+@override_settings(PUSH_REDIS_URL='')
+class PushTestCase(ApiTransactionTestCase):
+
+    async def connect(self, query, headers=()):
+        """
+        Opens /push/ through drf_course.asgi like an ASGI server would.
+        Returns the response status and a queue with the body chunks.
+        """
+        from drf_course.asgi import application
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/push/',
+            'query_string': query.encode(),
+            'headers': [(b'host', b'testserver'), *headers],
+        }
+        self.disconnected = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b''}
+            await self.disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        messages = asyncio.Queue()
+        self.connection = asyncio.ensure_future(
+            application(scope, receive, messages.put))
+        start = await asyncio.wait_for(messages.get(), timeout=2)
+        return start['status'], messages
+
+    async def next_event(self, messages):
+        message = await asyncio.wait_for(messages.get(), timeout=2)
+        return message['body']
+
+    async def disconnect(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.connection, timeout=2)
+
+    async def test_stock_changes_are_pushed_to_subscribers(self):
+        product = await Product.objects.acreate(name='Watch',
+                                                price='500.05',
+                                                stock=3)
+        status_code, messages = await self.connect(f'products={product.pk}')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(await self.next_event(messages), b'retry: 3000\n\n')
+
+        product.stock = 2
+        await product.asave()
+        event = await self.next_event(messages)
+        self.assertEqual(event.split(b'\n')[0], b'event: product')
+        self.assertEqual(json.loads(event.split(b'data: ')[1]), {
+            'id': product.pk,
+            'stock': 2,
+            'is_in_stock': True
+        })
+
+        #saved again without a stock change: nothing is sent
+        product.price = '450.00'
+        await product.asave()
+        product.stock = 0
+        await product.asave()
+        self.assertIn(b'"stock": 0', await self.next_event(messages))
+
+        await self.disconnect()
+        self.assertEqual(push.hub.subscriber_count(), 0)
+
+    async def test_order_updates_need_an_access_token(self):
+        status_code, _ = await self.connect('orders=1')
+        self.assertEqual(status_code, status.HTTP_401_UNAUTHORIZED)
+
+        user = await User.objects.acreate(username='user1')
+        token = str(RefreshToken.for_user(user).access_token)
+        status_code, messages = await self.connect(
+            'orders=1', [(b'authorization', f'Bearer {token}'.encode())])
+        self.assertEqual(status_code, 200)
+        await self.next_event(messages)
+
+        order = await Order.objects.acreate(user=user)
+        order.status = Order.StatusChoices.CONFIRMED
+        await order.asave()
+        events = [await self.next_event(messages) for _ in range(2)]
+        self.assertIn(b'"status": "Pending"', events[0])
+        self.assertIn(b'"status": "Confirmed"', events[1])
+        await self.disconnect()
+
+    async def test_redis_backend_forwards_only_the_subscribed_topics(self):
+        import fakeredis
+        import redis
+
+        server = fakeredis.FakeServer()
+        with mock.patch.object(
+                redis.Redis, 'from_url',
+                lambda url: fakeredis.FakeRedis(server=server)), mock.patch(
+                    'api.push._backend', push.RedisBackend('redis://push')):
+            user, other = [
+                await User.objects.acreate(username=name)
+                for name in ('user1', 'user2')
+            ]
+            token = str(RefreshToken.for_user(user).access_token)
+            status_code, messages = await self.connect(
+                'orders=1', [(b'authorization', f'Bearer {token}'.encode())])
+            self.assertEqual(status_code, 200)
+            await self.next_event(messages)
+            #the listener thread subscribes to the channel in the background
+            client = push.get_backend().client
+            while client.pubsub_numsub(push.REDIS_CHANNEL)[0][1] == 0:
+                await asyncio.sleep(0.01)
+
+            await Order.objects.acreate(user=other)
+            mine = await Order.objects.acreate(user=user)
+            #orders:<user2> went through Redis too, nobody here listens to it
+            event = await self.next_event(messages)
+            self.assertEqual(
+                json.loads(event.split(b'data: ')[1])['order_id'],
+                str(mine.pk))
+            self.assertTrue(messages.empty())
+
+            await self.disconnect()
+            #later events arrive over Redis but have nobody to go to
+            self.assertEqual(push.hub.subscriber_count(), 0)
+            self.assertEqual(
+                push.hub.dispatch(push.orders_topic(user.pk), 'order', {}), 0)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200)
+@mock.patch('time.sleep')
+class CompressionTestCase(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(10):
+            Product.objects.create(name=f'Product {i}', price='10.00', stock=i)
+
+    def test_negotiation(self, sleep):
+        self.assertEqual(
+            compression.negotiate('gzip, br;q=0.8', ['br', 'gzip']), 'gzip')
+        self.assertEqual(compression.negotiate('gzip, br', ['br', 'gzip']),
+                         'br')
+        self.assertEqual(compression.negotiate('*;q=0.5', ['gzip']), 'gzip')
+        self.assertIsNone(compression.negotiate('gzip;q=0', ['gzip']))
+        self.assertIsNone(compression.negotiate('', ['gzip']))
+
+    def test_cache_hits_are_served_precompressed(self, sleep):
+        plain = self.client.get('/products/')
+        self.assertNotIn('Content-Encoding', plain)
+
+        with mock.patch('api.compression.compress') as compress:
+            response = self.client.get('/products/',
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_uncached_responses_are_compressed_above_the_threshold(
+            self, sleep):
+        plain = self.client.get('/products/info')
+        response = self.client.get('/products/info',
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        product = Product.objects.first()
+        small = self.client.get(f'/products/{product.pk}/',
+                                HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', small)
+
+
+@override_settings(ORDER_BULK_STATUS_CHUNK_SIZE=2)
+class OrderBulkStatusTestCase(ApiTestCase):
+    username = 'user1'
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user(username='staff',
+                                              password='test',
+                                              is_staff=True)
+        self.pending = [Order.objects.create(user=self.user) for _ in range(4)]
+        self.canceled = Order.objects.create(
+            user=self.user, status=Order.StatusChoices.CANCELED)
+
+    def test_confirms_selected_orders_in_chunks(self):
+        self.client.force_login(self.staff)
+        generation = get_generation('order_list')
+        ids = [str(order.pk) for order in self.pending[:3]]
+        ids += [str(self.canceled.pk), '00000000-0000-0000-0000-000000000000']
+        with CaptureQueriesContext(connection) as queries, mock.patch.object(
+                push, 'publish') as publish:
+            response = self.client.post('/orders/bulk-status/', {
+                'status': 'Confirmed',
+                'ids': ids
+            },
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json(), {
+                'status': 'Confirmed',
+                'matched': 4,
+                'updated': 3,
+                'skipped': 1,
+                'missing': 1
+            })
+        #one UPDATE per chunk of 2 orders, the canceled order is left alone by its WHERE
+        updates = [
+            q['sql'] for q in queries.captured_queries
+            if q['sql'].startswith('UPDATE "api_order"')
+        ]
+        self.assertEqual(len(updates), 2)
+        self.assertIn('"status" IN', updates[0])
+        self.assertEqual(
+            Order.objects.filter(status=Order.StatusChoices.CONFIRMED).count(),
+            3)
+        self.assertEqual(get_generation('order_list'), generation + 1)
+        #update() sends no post_save, the events are published by the bulk action
+        self.assertEqual(publish.call_count, 3)
+
+    def test_selects_orders_with_filters(self):
+        self.client.force_login(self.staff)
+        response = self.client.post('/orders/bulk-status/?status=Pending',
+                                    {'status': 'Canceled'},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['updated'], 4)
+        self.assertFalse(
+            Order.objects.filter(status=Order.StatusChoices.PENDING).exists())
+
+        #no selection at all (an empty filter value selects nothing either),
+        #and transitions that are never allowed
+        for query, body in (
+            ('', {
+                'status': 'Confirmed'
+            }),
+            ('?status=', {
+                'status': 'Confirmed'
+            }),
+            ('', {
+                'status': 'Pending',
+                'ids': [str(self.canceled.pk)]
+            }),
+        ):
+            response = self.client.post(f'/orders/bulk-status/{query}',
+                                        body,
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            Order.objects.filter(status=Order.StatusChoices.CONFIRMED).count(),
+            0)
+
+    def test_ids_excluded_by_filters_are_not_missing(self):
+        self.client.force_login(self.staff)
+        ids = [str(self.pending[0].pk), str(self.canceled.pk)]
+        response = self.client.post('/orders/bulk-status/?status=Pending', {
+            'status': 'Canceled',
+            'ids': ids
+        },
+                                    content_type='application/json')
+        self.assertEqual(response.json()['matched'], 1)
+        self.assertEqual(response.json()['missing'], 0)
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/orders/bulk-status/?status=Pending',
+                                    {'status': 'Canceled'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OrderItemSnapshotTestCase(ApiTestCase):
+    username = 'user1'
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Watch',
+                                              price='500.05',
+                                              stock=3)
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order,
+                                 product=self.product,
+                                 quantity=2)
+
+    def test_orders_keep_the_price_they_were_placed_at(self):
+        self.client.force_login(self.user)
+        before = self.client.get(f'/orders/{self.order.pk}/').json()
+        self.assertEqual(before['total_price'], 1000.1)
+
+        self.product.name = 'Smart Watch'
+        self.product.price = '600.00'
+        self.product.save()
+        after = self.client.get(f'/orders/{self.order.pk}/').json()
+        self.assertEqual(after, before)
+        self.assertEqual(after['items'][0]['product_name'], 'Watch')
+
+    def test_order_list_does_not_read_products(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/orders/')
+        self.assertEqual(response.json()[0]['items'][0]['product_price'],
+                         '500.05')
+        self.assertFalse([
+            q for q in queries.captured_queries
+            if 'FROM "api_product"' in q['sql']
+        ])
+
+
+@override_settings(WARM_CACHE_RECORD_RATE=1,
+                   WARM_CACHE_PRODUCT_PATHS=['/products/'])
+@mock.patch('time.sleep')
+class WarmCacheTestCase(ApiTransactionTestCase):
+    username = 'user1'
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(name='Watch', price='500.05', stock=3)
+        Order.objects.create(user=self.user)
+        User.objects.create_user(username='inactive', password='test')
+        #every test starts as a fresh process
+        warmup._started_pid = None
+        warmup._pending.clear()
+
+    def test_warms_popular_product_lists_and_active_users_orders(self, sleep):
+        for _ in range(3):
+            self.client.get('/products/?ordering=price')
+        self.client.get('/products/?search=watch')
+        #a deploy: the responses are stale, the recorded counts are kept
+        recorded = warmup.recorded_requests('product_list')
+        self.assertEqual(recorded, {
+            '/products/?ordering=price': 3,
+            '/products/?search=watch': 1
+        })
+        bump_generation('product_list')
+        sleep.reset_mock()
+
+        out = StringIO()
+        call_command('warm_cache', '--top=1', '--concurrency=2', stdout=out)
+        self.assertIn('2 product list queries, 1 users', out.getvalue())
+        self.assertIn('75% of the recorded', out.getvalue())
+        #warming is not traffic
+        self.assertEqual(warmup.recorded_requests('product_list'), recorded)
+        #the view ran once per warmed product list...
+        self.assertEqual(sleep.call_count, 2)
+
+        #...and the real requests are cache hits
+        self.client.get('/products/?ordering=price')
+        self.client.get('/products/')
+        self.assertEqual(sleep.call_count, 2)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/orders/')
+        self.assertFalse(
+            [q for q in queries.captured_queries if 'api_order' in q['sql']])
+
+    def test_cache_hits_only_count_in_memory(self, sleep):
+        self.client.get('/products/?ordering=price')
+        with mock.patch.object(warmup, 'cache') as shared:
+            self.client.get('/products/?ordering=price')
+        self.assertEqual(shared.method_calls, [])
+        #the next miss writes what the hits recorded, one incr per path
+        self.client.get('/products/?search=watch')
+        self.assertEqual(warmup.recorded_requests('product_list'), {
+            '/products/?ordering=price': 2,
+            '/products/?search=watch': 1
+        })
+
+    def test_startup_hook_warms_once(self, sleep):
+        self.assertIsNone(warmup.warm_on_startup())
+        with override_settings(WARM_CACHE_ON_STARTUP=True), mock.patch.object(
+                warmup, 'warm_cache') as warm_cache:
+            warmup.warm_on_startup().join()
+            #the same process again (post_fork and then its first request)
+            self.assertIsNone(warmup.warm_on_startup())
+            #another process starting during the same deploy
+            warmup._started_pid = None
+            self.assertIsNone(warmup.warm_on_startup())
+        warm_cache.assert_called_once()
+
+    def test_first_request_warms_without_a_post_fork_hook(self, sleep):
+        with override_settings(WARM_CACHE_ON_STARTUP=True), mock.patch.object(
+                warmup, 'warm_on_startup') as warm_on_startup:
+            request_started.connect(warmup.warm_on_first_request)
+            try:
+                self.client.get('/products/')
+            finally:
+                request_started.disconnect(warmup.warm_on_first_request)
+        warm_on_startup.assert_called_once()
@@ -0,0 +1,149 @@
+"""
+Token bucket throttles that cost a single atomic operation per request.
+
+With Redis the whole bucket update (refill + take a token) is one Lua script call.
+Without Redis (or when it is unreachable) every process keeps its own buckets in memory,
+which still protects the database, just per process instead of per cluster.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / refill
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {allowed, tostring(wait)}
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+REDIS_RETRY_AFTER = 5
+LOCAL_MAX_BUCKETS = 100000
+
+_redis_script = None
+_redis_checked = False
+_redis_down_until = 0
+#least recently used first
+_local_buckets = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """
+    '120/min' -> (capacity 120, refill 2 tokens per second)
+    """
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def _get_redis_script():
+    global _redis_script, _redis_checked
+    if not _redis_checked:
+        _redis_checked = True
+        try:
+            from django_redis import get_redis_connection
+            client = get_redis_connection(settings.THROTTLE_CACHE_ALIAS)
+        except (ImportError, NotImplementedError, ImproperlyConfigured):
+            #the throttle cache is not django_redis: per-process buckets only
+            _redis_script = None
+        else:
+            _redis_script = client.register_script(TOKEN_BUCKET_LUA)
+    return _redis_script
+
+
+def take_token_redis(script, key, capacity, refill):
+    ttl = int(capacity / refill) + 1
+    allowed, wait = script(keys=[key], args=[capacity, refill, ttl])
+    return bool(allowed), float(wait)
+
+
+def take_token_local(key, capacity, refill):
+    now = time.monotonic()
+    with _local_lock:
+        bucket = _local_buckets.get(key)
+        if bucket is None:
+            if len(_local_buckets) >= LOCAL_MAX_BUCKETS:
+                #forget the client idle the longest, not everybody's budget at once
+                _local_buckets.popitem(last=False)
+            tokens = capacity
+        else:
+            _local_buckets.move_to_end(key)
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill)
+        if tokens >= 1:
+            _local_buckets[key] = (tokens - 1, now)
+            return True, 0
+        _local_buckets[key] = (tokens, now)
+        return False, (1 - tokens) / refill
+
+
+def take_token(key, capacity, refill):
+    global _redis_down_until
+    script = _get_redis_script()
+    if script is not None and time.monotonic() >= _redis_down_until:
+        try:
+            return take_token_redis(script, key, capacity, refill)
+        except Exception:
+            #Redis is down: don't fail the request, limit per process instead
+            #and don't try Redis again for a few seconds
+            _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+    return take_token_local(key, capacity, refill)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits requests per user (or per IP address for anonymous requests).
+    The rate comes from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'][scope],
+    e.g. '120/min' = bursts of up to 120 requests, refilled at 2 per second.
+    """
+    scope = None
+
+    def __init__(self):
+        self.capacity, self.refill = parse_rate(self.get_rate())
+        self.wait_time = None
+
+    def get_rate(self):
+        return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return f'throttle:{self.scope}:{ident}'
+
+    def allow_request(self, request, view):
+        allowed, self.wait_time = take_token(self.get_cache_key(request, view),
+                                             self.capacity, self.refill)
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class ProductBrowseThrottle(TokenBucketThrottle):
+    scope = 'products'
+
+
+class OrderCreateThrottle(TokenBucketThrottle):
+    scope = 'order_create'
@@ -0,0 +1,82 @@
+"""
+Bulk order status changes for staff (POST /orders/bulk-status/), chunk by chunk:
+
+    SELECT order_id, user_id, status FROM api_order WHERE ... AND order_id > ? ORDER BY order_id LIMIT ?
+    UPDATE api_order SET status = ? WHERE order_id IN (...) AND status IN (...)
+
+The `status IN` of the UPDATE is the list of statuses the target status may be reached from,
+so an order that is not in one of them is skipped by the database, not by Python.
+update() sends no signals: the order list cache is invalidated once at the end
+and the push events are published here.
+"""
+from django.db import transaction
+
+from api import push
+from api.cache import bump_generation
+from api.models import Order
+from api.querybudget import batched
+from api.routers import on_primary
+
+#target status -> the statuses it may be reached from; nothing goes back to Pending
+ALLOWED_TRANSITIONS = {
+    Order.StatusChoices.CONFIRMED: (Order.StatusChoices.PENDING, ),
+    Order.StatusChoices.CANCELED:
+    (Order.StatusChoices.PENDING, Order.StatusChoices.CONFIRMED),
+}
+
+
+def transition_batch(orders, status, after, chunk_size):
+    """
+    Moves the next chunk of `orders` (primary keys after `after`) to `status`.
+    Returns (last primary key of the chunk, orders in the chunk, orders updated).
+    """
+    allowed = ALLOWED_TRANSITIONS[status]
+    with transaction.atomic():
+        chunk = orders.order_by('pk')
+        if after is not None:
+            chunk = chunk.filter(pk__gt=after)
+        #locked until the chunk commits, so the rows selected for the UPDATE are the rows it changes
+        rows = list(chunk.select_for_update().values_list(
+            'pk', 'user_id', 'status')[:chunk_size])
+        if not rows:
+            return None, 0, 0
+        changing = [(pk, user_id) for pk, user_id, current in rows
+                    if current in allowed]
+        updated = 0
+        if changing:
+            updated = Order.objects.filter(
+                pk__in=[pk for pk, _ in changing],
+                status__in=allowed).update(status=status)
+        for pk, user_id in changing:
+            push.publish(push.orders_topic(user_id), 'order', {
+                'order_id': str(pk),
+                'status': status,
+            })
+    return rows[-1][0], len(rows), updated
+
+
+def transition_orders(orders, status, chunk_size):
+    """
+    Moves every order of the queryset that may reach `status` to it.
+    Returns the counts: matched (selected), updated and skipped (not allowed from their status).
+    """
+    matched = updated = 0
+    after = None
+    #the chunks must see the writes of the previous ones, not a lagging replica
+    with on_primary(), batched():
+        while True:
+            after, selected, changed = transition_batch(
+                orders, status, after, chunk_size)
+            if not selected:
+                break
+            matched += selected
+            updated += changed
+    if updated:
+        #one invalidation for the whole run
+        bump_generation('order_list')
+    return {
+        'status': status,
+        'matched': matched,
+        'updated': updated,
+        'skipped': matched - updated,
+    }
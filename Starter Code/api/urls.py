@@ -11,6 +11,14 @@ urlpatterns = [
         'products/info',
         views.ProductInfoAPIView.as_view(),
     ),
+    path(
+        'products/batch',
+        views.ProductBatchAPIView.as_view(),
+    ),
+    path(
+        'products/changes',
+        views.ProductChangesAPIView.as_view(),
+    ),
     path(
         'products/<int:product_id>/',
         views.ProductDetailAPIView.as_view(),
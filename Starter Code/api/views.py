@@ -1,22 +1,57 @@
 from django.shortcuts import get_object_or_404
 from api.serializers import ProductSerializer, OrderSerializer, ProductInfoSerializer, OrderCreateSerializer, UserSerializer
-from api.models import Product, Order, User
+from api.serializers import ArchivedOrderSerializer, OrderBulkStatusSerializer, prune_queryset, requested_fieldset
+from api.models import ArchivedOrder, Product, ProductChange, Order, User
+from api.changefeed import changes_since
+from django.conf import settings
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.db.models import Max
+from django.core.cache import cache
+from django.http import Http404
 from rest_framework import generics, viewsets
-from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 from api.filters import ProductFilter, InStockFilterBackend, OrderFilter
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.pagination import PageNumberPagination
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
+from api.cache import cached_view, product_cache_key
+from api.idempotency import IdempotentCreateMixin
+from api.throttling import OrderCreateThrottle, ProductBrowseThrottle
+from api.routers import ReadYourWritesMixin, remember_write
+from api.transitions import transition_orders
 
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+class SparseFieldsetsQuerysetMixin:
+    """
+    With ?fields= or ?exclude= the queryset only selects the columns the serializer still needs.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if any(requested_fieldset(self.request)):
+            queryset = prune_queryset(queryset, self.get_serializer().fields)
+        return queryset
+
+
+class BrowseThrottleMixin:
+    """
+    Reads are throttled with the browse budget, staff adding or editing products are not browsing.
+    """
+    throttle_classes = [ProductBrowseThrottle]
+
+    def get_throttles(self):
+        if self.request.method not in SAFE_METHODS:
+            return []
+        return super().get_throttles()
+
+
+class ProductListCreateAPIView(BrowseThrottleMixin,
+                               SparseFieldsetsQuerysetMixin,
+                               ReadYourWritesMixin,
+                               generics.ListCreateAPIView):
     """
     View to list and create products in the inventory.
     """
@@ -30,6 +65,9 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
         InStockFilterBackend
     ]
     serializer_class = ProductSerializer
+    #max SQL queries per request, checked by api.querybudget.
+    #count + page + up to 2 for authentication (session + user, JWT only needs the user)
+    query_budget = 4
     filterset_class = ProductFilter
     #filterset_fields = ('name', 'price')
     search_fields = ['name', 'description']
@@ -43,7 +81,7 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
     #here we are hard coding it to 2 but we can also make it dynamic by adding the size query param in the url
     pagination_class.max_page_size = 6
 
-    @method_decorator(cache_page(60 * 15, key_prefix='product_list'))
+    @cached_view('product_list', timeout=60 * 15)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
@@ -70,8 +108,159 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
 #    serializer = ProductSerializer(products, many=True)
 #    return Response(serializer.data)
 
+#largest value of a 64-bit primary key
+MAX_ID = 2**63 - 1
+
+
+class ProductBatchAPIView(ReadYourWritesMixin, APIView):
+    """
+    Several products in one request, for carts and wishlists:
+    GET /products/batch?ids=3,1,7 or POST /products/batch {"ids": [3, 1, 7]}.
+    Products come back in the requested order, ids that don't exist are listed in "missing".
+    """
+    permission_classes = [AllowAny]
+    throttle_classes = [ProductBrowseThrottle]
+    #authentication + one in_bulk query for whatever was not cached
+    query_budget = 3
+    max_ids = 100
+
+    def get(self, request):
+        return self.batch(request.query_params.getlist('ids'))
+
+    def post(self, request):
+        #a POST body has no URL length limit, it still only reads
+        data = request.data
+        if isinstance(data, list):
+            #a bare array is the list of ids
+            return self.batch(data)
+        if not isinstance(data, dict):
+            raise ValidationError(
+                {'ids': 'Send {"ids": [...]} or a list of ids.'})
+        ids = data.get('ids', [])
+        return self.batch(ids if isinstance(ids, list) else [ids])
+
+    def parse_ids(self, values):
+        #a dict keeps the requested order and makes the duplicate check O(1)
+        ids = {}
+        for value in values:
+            parts = value.split(',') if isinstance(value, str) else [value]
+            for part in parts:
+                if isinstance(part, str) and not part.strip():
+                    continue
+                try:
+                    if isinstance(part, bool):
+                        raise TypeError
+                    pk = int(part)
+                except (TypeError, ValueError):
+                    pk = None
+                #the range of the primary key column, larger values overflow the database driver
+                if pk is None or not 1 <= pk <= MAX_ID:
+                    raise ValidationError(
+                        {'ids': f'"{part}" is not a valid id.'})
+                ids[pk] = None
+                #checked while parsing: a huge query string is rejected early
+                if len(ids) > self.max_ids:
+                    raise ValidationError(
+                        {'ids': f'At most {self.max_ids} ids per request.'})
+        if not ids:
+            raise ValidationError({'ids': 'Give at least one id.'})
+        return list(ids)
 
-class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+    def batch(self, values):
+        ids = self.parse_ids(values)
+        keys = {pk: product_cache_key(pk) for pk in ids}
+        #one round trip for the cached products ...
+        cached = cache.get_many(list(keys.values()))
+        found = {pk: cached[key] for pk, key in keys.items() if key in cached}
+        misses = [pk for pk in ids if pk not in found]
+        if misses:
+            #... and one query for the rest
+            products = Product.objects.in_bulk(misses)
+            #one serializer for all of them, not one per product
+            serialized = ProductSerializer(products.values(), many=True).data
+            fresh = {
+                pk: {
+                    'id': pk,
+                    **item
+                }
+                for pk, item in zip(products, serialized)
+            }
+            cache.set_many({
+                keys[pk]: data
+                for pk, data in fresh.items()
+            }, 60 * 15)
+            found.update(fresh)
+        return Response({
+            'products': [found[pk] for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found],
+        })
+
+
+class ProductChangesAPIView(ReadYourWritesMixin, APIView):
+    """
+    What changed in the catalog since a sync token: GET /products/changes?since=<next>.
+    Start with since=0, keep following "next" while "has_more" is true, store the last "next".
+    Every product appears once, in its current state (or as a delete).
+    """
+    permission_classes = [AllowAny]
+    throttle_classes = [ProductBrowseThrottle]
+    #authentication + latest change per product + those changes + the products
+    query_budget = 5
+
+    def get(self, request):
+        since = self.int_param(request, 'since', 0)
+        limit = min(
+            self.int_param(request,
+                           'limit',
+                           settings.PRODUCT_CHANGES_PAGE_SIZE,
+                           minimum=1), settings.PRODUCT_CHANGES_MAX_PAGE_SIZE)
+        changes, has_more = changes_since(since, limit)
+
+        upserted = Product.objects.in_bulk([
+            change.product_id for change in changes
+            if change.action == ProductChange.ActionChoices.UPSERT
+        ])
+        serialized = dict(
+            zip(upserted,
+                ProductSerializer(upserted.values(), many=True).data))
+        results = []
+        for change in changes:
+            product = serialized.get(change.product_id)
+            if product is None:
+                #deleted, or deleted right after this change was logged
+                results.append({
+                    'id': change.product_id,
+                    'action': ProductChange.ActionChoices.DELETE,
+                })
+            else:
+                results.append({
+                    'id': change.product_id,
+                    'action': ProductChange.ActionChoices.UPSERT,
+                    'product': {
+                        'id': change.product_id,
+                        **product
+                    },
+                })
+        return Response({
+            'changes': results,
+            'next': changes[-1].pk if changes else since,
+            'has_more': has_more,
+        })
+
+    def int_param(self, request, name, default, minimum=0):
+        value = request.query_params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: 'Must be a whole number.'})
+        if value < minimum:
+            raise ValidationError({name: f'Must be at least {minimum}.'})
+        return value
+
+
+class ProductDetailAPIView(BrowseThrottleMixin, SparseFieldsetsQuerysetMixin,
+                           ReadYourWritesMixin,
+                           generics.RetrieveUpdateDestroyAPIView):
     """
     Used to get a single object by its primary key (id)
     View to retrieve a specific product by its primary key (pk).
@@ -84,6 +273,8 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     #we can change the name of the value we are getting from the url and then change the lookup_url_kwarg to match it.
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    #staff edits also write the change log, a delete first collects the related order items
+    query_budget = {'get': 4, 'put': 5, 'patch': 5, 'delete': 7}
     lookup_url_kwarg = 'product_id'
 
     def get_permissions(self):
@@ -103,34 +294,112 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 #    return Response(serializer.data)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(IdempotentCreateMixin, SparseFieldsetsQuerysetMixin,
+                   ReadYourWritesMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing and editing order instances.
     """
-    queryset = Order.objects.prefetch_related('items__product')
+    #the items carry their own price/name snapshot, the products are never read
+    queryset = Order.objects.prefetch_related('items')
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    #authentication + orders + prefetched items
+    #(+ the archive lookup when retrieving an order that is not live anymore)
+    query_budget = {'list': 4, 'retrieve': 5}
     pagination_class = None
     filter_backends = [DjangoFilterBackend]
     filterset_class = OrderFilter
 
-    @method_decorator(cache_page(60 * 15, key_prefix='order_list'))
-    @method_decorator(vary_on_headers("Authorization"))
+    #every user sees only their own orders, so the cache is per user
+    @cached_view('order_list', timeout=60 * 15, per_user=True)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            #old finished orders are moved to the archive tables (see api/archive.py),
+            #they can still be read by order_id, but not changed
+            return self.retrieve_archived(request, kwargs[self.lookup_field])
+
+    def retrieve_archived(self, request, pk):
+        archived = ArchivedOrder.objects.prefetch_related('items')
+        if not request.user.is_staff:
+            archived = archived.filter(user=request.user)
+        order = generics.get_object_or_404(archived, pk=pk)
+        serializer = ArchivedOrderSerializer(
+            order, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    @action(detail=False,
+            methods=['post'],
+            url_path='bulk-status',
+            permission_classes=[IsAdminUser])
+    def bulk_status(self, request):
+        """
+        Staff only: moves many orders to a new status, e.g. confirms every pending order of a day:
+        POST /orders/bulk-status/?status=Pending&created_at=2024-05-01 {"status": "Confirmed"}
+        Orders whose status does not allow the change are skipped and counted.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('ids')
+        filterset = OrderFilter(request.query_params,
+                                queryset=Order.objects.all(),
+                                request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        #?status= (empty) is dropped by django-filter, it must not count as a selection
+        filtered = any(value not in (None, '', [])
+                       for value in filterset.form.cleaned_data.values())
+        if not ids and not filtered:
+            #never every order by accident
+            raise ValidationError(
+                {'ids': 'Select the orders by id or with filter parameters.'})
+
+        orders = filterset.qs
+        missing = None
+        if ids is not None:
+            ids = set(ids)
+            #ids that match no order at all, not the ones the filters left out
+            missing = len(ids - set(
+                Order.objects.filter(pk__in=ids).values_list('pk', flat=True)))
+            orders = orders.filter(pk__in=ids)
+        counts = transition_orders(orders, serializer.validated_data['status'],
+                                   settings.ORDER_BULK_STATUS_CHUNK_SIZE)
+        if missing is not None:
+            counts['missing'] = missing
+        remember_write(request.user)
+        return Response(counts)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        #the replica may not have the new order yet, keep this user's next reads on the primary
+        remember_write(self.request.user)
+
+    def get_throttles(self):
+        #creating orders has its own, much smaller budget
+        if self.action == 'create':
+            return [OrderCreateThrottle()]
+        return super().get_throttles()
 
     def get_serializer_class(self):
         if self.action == 'create' or self.action == 'update':
             return OrderCreateSerializer
+        if self.action == 'bulk_status':
+            return OrderBulkStatusSerializer
         return super().get_serializer_class()
 
     def get_queryset(self):
         qs = super().get_queryset()
         if not self.request.user.is_staff:
             qs = qs.filter(user=self.request.user)
+        fields = self.get_serializer().fields
+        if 'items' not in fields and 'total_price' not in fields:
+            #the client asked for neither the items nor the total (?fields=order_id,status),
+            #so there is nothing to prefetch
+            qs = qs.prefetch_related(None)
         return qs
 
     #class OrderListAPIView(generics.ListAPIView):
@@ -193,17 +462,20 @@ class ProductInfoAPIView(APIView):
     """
     View to provide aggregated product information.
     """
+    query_budget = 4
 
     def get(self, request):
+        serializer = ProductInfoSerializer(context={'request': request})
         products = Product.objects.all()
-        serializer = ProductInfoSerializer({
-            'products':
-            products,
-            'count':
-            len(products),
+        if any(requested_fieldset(request)):
+            products = prune_queryset(
+                products, serializer.fields['products'].child.fields)
+        serializer.instance = {
+            'products': products,
+            'count': len(products),
             'max_price':
             products.aggregate(max_price=Max('price'))['max_price'],
-        })
+        }
         return Response(serializer.data)
 
 
@@ -223,6 +495,8 @@ class ProductInfoAPIView(APIView):
 
 
 class UserListView(generics.ListAPIView):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related('orders')
+    #UserSerializer lists the ids of each user's orders, without the prefetch that was one query per user
+    query_budget = 4
     serializer_class = UserSerializer
     pagination_class = None
@@ -0,0 +1,259 @@
+"""
+Fills the product_list and order_list response caches before traffic does, so the first wave
+of requests after a deploy or a Redis flush doesn't run every uncached list view at once:
+
+    python manage.py warm_cache
+
+Product lists: WARM_CACHE_PRODUCT_PATHS plus the most requested product list queries.
+cached_view records a sample (WARM_CACHE_RECORD_RATE) of the requests it serves. Each process
+tallies them in memory and adds them to one counter per path in the cache (an atomic incr) when
+it rebuilds an entry anyway, so a cache hit never writes. Right after a flush only the configured
+paths are known.
+Order lists: the orders of every user who ordered in the last WARM_CACHE_ACTIVE_DAYS days.
+
+Every path goes through its view like a client request (without the throttles),
+so the entries end up under exactly the keys real requests look up.
+With WARM_CACHE_ON_STARTUP a web worker warms in a background thread when it starts:
+gunicorn's post_fork hook (drf_course/gunicorn_api.py) or, for servers without one, the
+worker's first request. Never at import time, a preloading master must not start threads.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Max
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from api.models import Order, User
+
+logger = logging.getLogger(__name__)
+
+STARTUP_LOCK_KEY = 'warm_cache:startup:lock'
+
+#the process that already tried warming on startup (a forked worker has a new pid)
+_started_pid = None
+_started_lock = threading.Lock()
+
+#prefix -> Counter of the requests recorded since the last flush_requests()
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def popular_key(prefix):
+    #the paths that have a counter
+    return f'warm_cache:popular:{prefix}'
+
+
+def counter_key(prefix, path):
+    #':count' keys skip TieredCache's local tier (SHARED_ONLY_SUFFIXES)
+    digest = hashlib.md5(path.encode()).hexdigest()
+    return f'{popular_key(prefix)}:{digest}:count'
+
+
+def _get_shared(key):
+    return getattr(cache, 'get_shared', cache.get)(key)
+
+
+def record_request(prefix, request):
+    """
+    Counts a sample of the requests served by cached_view(prefix), in this process' memory:
+    most of them are cache hits, which must not pay for a cache write.
+    """
+    if getattr(request, 'cache_warmup', False):
+        #our own replays must not make their paths more popular
+        return
+    if random.random() >= settings.WARM_CACHE_RECORD_RATE:
+        return
+    with _pending_lock:
+        _pending.setdefault(prefix, Counter())[request.get_full_path()] += 1
+
+
+def flush_requests(prefix):
+    """
+    Adds the requests this process recorded to the shared counts, one atomic incr per path.
+    cached_view calls it when it rebuilds an entry, that request runs the view anyway.
+    """
+    with _pending_lock:
+        pending = _pending.pop(prefix, None)
+    if not pending:
+        return
+    for path, count in pending.items():
+        key = counter_key(prefix, path)
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            if not cache.add(key, count, None):
+                cache.incr(key, count)
+
+    paths = _get_shared(popular_key(prefix)) or []
+    new_paths = [path for path in pending if path not in paths]
+    if not new_paths:
+        return
+    #two processes adding paths at once may lose one, its next flush adds it again
+    paths = paths + new_paths
+    if len(paths) > settings.WARM_CACHE_TRACKED_PATHS:
+        #forget the rarest half, new queries need room to climb
+        counts = recorded_requests(prefix, paths)
+        kept = [
+            path for path, _ in counts.most_common(
+                settings.WARM_CACHE_TRACKED_PATHS // 2)
+        ]
+        cache.delete_many(
+            [counter_key(prefix, path) for path in paths if path not in kept])
+        paths = kept
+    cache.set(popular_key(prefix), paths, None)
+
+
+def recorded_requests(prefix, paths=None):
+    """
+    How often each path was recorded, by all processes (what they flushed so far).
+    """
+    if paths is None:
+        paths = _get_shared(popular_key(prefix)) or []
+    keys = {counter_key(prefix, path): path for path in paths}
+    counts = cache.get_many(list(keys))
+    return Counter({keys[key]: count for key, count in counts.items()})
+
+
+def product_paths(top):
+    """
+    The configured paths first, then the `top` most requested ones.
+    Returns (paths, recorded request counts).
+    """
+    flush_requests('product_list')
+    recorded = recorded_requests('product_list')
+    paths = list(settings.WARM_CACHE_PRODUCT_PATHS)
+    for path, _ in recorded.most_common(top):
+        if path not in paths:
+            paths.append(path)
+    return paths, recorded
+
+
+def active_users(days, limit):
+    """
+    The users who ordered most recently, at most `limit` of them.
+    """
+    since = timezone.now() - timedelta(days=days)
+    user_ids = list(
+        Order.objects.filter(created_at__gte=since).values('user').annotate(
+            last=Max('created_at')).order_by('-last').values_list(
+                'user', flat=True)[:limit])
+    return list(User.objects.filter(pk__in=user_ids))
+
+
+def warm_path(path, user=None):
+    """
+    Runs the view behind path once, returns True if it answered 200.
+    """
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    request = APIRequestFactory().get(path, HTTP_ACCEPT='application/json')
+    request.cache_warmup = True
+    if user is not None:
+        force_authenticate(request, user)
+    match = resolve(request.path_info)
+    view = match.func
+    #the same view without throttles: warming must not use up anybody's request budget
+    initkwargs = {**view.initkwargs, 'throttle_classes': ()}
+    if getattr(view, 'actions', None):
+        view = view.cls.as_view(view.actions, **initkwargs)
+    else:
+        view = view.cls.as_view(**initkwargs)
+    try:
+        response = view(request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception('Could not warm %s', path)
+        return False
+    finally:
+        #pool threads must not keep their connections open
+        connections.close_all()
+    return response.status_code == 200
+
+
+def warm_cache(concurrency=None, top=None, users=None):
+    """
+    Warms the popular product lists and the active users' order lists,
+    at most `concurrency` at a time. Returns a report of what was covered.
+    """
+    concurrency = concurrency or settings.WARM_CACHE_CONCURRENCY
+    top = settings.WARM_CACHE_TOP_PRODUCT_QUERIES if top is None else top
+    users = settings.WARM_CACHE_ACTIVE_USERS if users is None else users
+
+    started = time.monotonic()
+    paths, recorded = product_paths(top)
+    order_path = reverse('order-list')
+    jobs = [(path, None) for path in paths]
+    jobs += [(order_path, user)
+             for user in active_users(settings.WARM_CACHE_ACTIVE_DAYS, users)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda job: warm_path(*job), jobs))
+
+    warmed_paths = {
+        path
+        for (path, user), ok in zip(jobs, results) if ok and user is None
+    }
+    #share of the recorded product list traffic that now hits a warm entry
+    total = sum(recorded.values())
+    covered = sum(recorded[path] for path in warmed_paths)
+    return {
+        'product_paths': len(paths),
+        'users': len(jobs) - len(paths),
+        'warmed': sum(results),
+        'failed': len(results) - sum(results),
+        'traffic_covered': covered / total if total else None,
+        'seconds': time.monotonic() - started,
+    }
+
+
+def _warm_in_background():
+    try:
+        report = warm_cache()
+    except Exception:
+        logger.exception('Warming the cache on startup failed')
+    else:
+        logger.info('Cache warmed on startup: %s', report)
+
+
+def warm_on_startup():
+    """
+    With WARM_CACHE_ON_STARTUP, starts warming in a background thread, at most once per process.
+    Every worker calls it, the first one to take the lock does the work.
+    """
+    global _started_pid
+    if not settings.WARM_CACHE_ON_STARTUP:
+        return None
+    with _started_lock:
+        if _started_pid == os.getpid():
+            return None
+        _started_pid = os.getpid()
+    try:
+        if not cache.add(STARTUP_LOCK_KEY, 1,
+                         settings.WARM_CACHE_STARTUP_LOCK):
+            return None
+    except Exception:
+        #never keep the application from starting
+        logger.exception('Could not take the cache warming lock')
+        return None
+    thread = threading.Thread(target=_warm_in_background,
+                              name='warm-cache',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_on_first_request(**kwargs):
+    """
+    request_started receiver, for servers without a post-fork hook (runserver, ASGI servers).
+    """
+    if _started_pid != os.getpid():
+        warm_on_startup()
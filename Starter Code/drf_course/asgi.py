@@ -2,6 +2,7 @@
 ASGI config for drf_course project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+/push/ (server-sent events, see api/push.py) is served next to Django, everything else by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -13,4 +14,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_course.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+#imported once Django is set up
+from api import push  # noqa: E402
+
+PUSH_PATH = '/push/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == PUSH_PATH:
+        return await push.application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,51 @@
+"""
+gunicorn configuration for API workers:
+
+    gunicorn -c drf_course/gunicorn_api.py
+
+preload_app imports Django, the URLconf, the views and the serializers once in the master process.
+Forked workers share those memory pages copy-on-write instead of importing everything again.
+"""
+import gc
+import multiprocessing
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_course.settings_api')
+
+wsgi_app = 'drf_course.wsgi:application'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(
+    os.environ.get('GUNICORN_WORKERS',
+                   multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+#no collections while the app is preloaded: the import garbage is collected once, in when_ready
+gc.disable()
+
+
+def when_ready(server):
+    #the app is loaded and no worker forked yet: freeze what survives and collect normally again,
+    #the master keeps running (and allocating) for the whole life of the server
+    gc.collect()
+    gc.freeze()
+    gc.enable()
+
+
+def pre_fork(server, worker):
+    #the master collects garbage before every fork and freezes the survivors,
+    #otherwise the workers' collector touches (and copies) every shared object
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from django.db import connections
+
+    from api.warmup import warm_on_startup
+
+    #connections opened in the master must not be shared between processes
+    connections.close_all()
+    #in the worker, not the master: a thread started before the fork would not survive it
+    warm_on_startup()
@@ -1,19 +1,44 @@
+import os
 from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+
+def env(name, default=None):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+#Everything that differs between a laptop and a production server is read from the environment.
+#The defaults keep the original development behaviour (SQLite file, DEBUG on, local Redis).
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-%hjisw!0c0)bs&s9m#0e(#(=g54-#f+q2-d3+p%puk)0=5qrp#'
+SECRET_KEY = env(
+    'DJANGO_SECRET_KEY',
+    'django-insecure-%hjisw!0c0)bs&s9m#0e(#(=g54-#f+q2-d3+p%puk)0=5qrp#')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env_bool('DJANGO_DEBUG', True)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [
+    host for host in env('DJANGO_ALLOWED_HOSTS', '').split(',') if host
+]
 
 # Application definition
 
@@ -34,6 +59,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    #outermost after security: compresses what every other middleware produced
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -41,10 +68,14 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'silk.middleware.SilkyMiddleware',
+    'api.middleware.PrimaryPinningMiddleware',
+    'api.querybudget.QueryInspectorMiddleware',
 ]
 
 ROOT_URLCONF = 'drf_course.urls'
 
+TEST_RUNNER = 'drf_course.test_runner.TestRunner'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -66,13 +97,105 @@ WSGI_APPLICATION = 'drf_course.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+DB_ENGINE = env('DB_ENGINE', 'django.db.backends.sqlite3')
+
+#PRAGMAs applied to every new SQLite connection when the tuning mode is on.
+#journal_mode=WAL lets readers keep reading while one writer writes,
+#synchronous=NORMAL is safe with WAL and avoids an fsync per commit,
+#mmap_size/cache_size keep hot pages in memory, busy_timeout makes a writer wait for the lock instead of failing.
+SQLITE_PRAGMAS = {
+    'journal_mode': env('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': env('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    #negative means KiB, so 64MB
+    'cache_size': env_int('SQLITE_CACHE_SIZE', -64000),
+    'busy_timeout': env_int('SQLITE_BUSY_TIMEOUT', 5000),  # milliseconds
+    'temp_store': 'MEMORY',
 }
 
+
+def database_settings(debug):
+    """
+    DATABASES for the given DEBUG. The production defaults (persistent connections, SQLite tuning)
+    depend on it, so a profile that changes DEBUG (drf_course/settings_api.py) builds them again.
+    """
+    databases = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': env('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'USER': env('DB_USER', ''),
+            'PASSWORD': env('DB_PASSWORD', ''),
+            'HOST': env('DB_HOST', ''),
+            'PORT': env('DB_PORT', ''),
+            #CONN_MAX_AGE keeps the connection open between requests instead of reconnecting every time.
+            #0 means close after each request (the old behaviour), None means keep it forever.
+            'CONN_MAX_AGE': env_int('DB_CONN_MAX_AGE', 0 if debug else 60),
+            #Health checks make Django test a persistent connection before reusing it,
+            #so a connection dropped by the database server is replaced instead of raising an error.
+            'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+            'OPTIONS': {},
+        }
+    }
+
+    if DB_ENGINE == 'django.db.backends.sqlite3' and env_bool(
+            'SQLITE_TUNING', not debug):
+        databases['default']['OPTIONS'].update({
+            'init_command':
+            ''.join(f'PRAGMA {name}={value};'
+                    for name, value in SQLITE_PRAGMAS.items()),
+            #BEGIN IMMEDIATE takes the write lock at the start of transaction.atomic(),
+            #so two writers never both read and then deadlock trying to upgrade to a write lock.
+            'transaction_mode':
+            'IMMEDIATE',
+            'timeout':
+            SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        })
+
+    if DB_ENGINE == 'django.db.backends.postgresql' and env_bool('DB_POOL'):
+        #Server-side connection pool (psycopg 3 + psycopg_pool).
+        #Django does not allow a pool together with persistent connections, the pool itself keeps them open.
+        from psycopg_pool import ConnectionPool
+
+        databases['default']['CONN_MAX_AGE'] = 0
+        databases['default']['OPTIONS']['pool'] = {
+            'min_size': env_int('DB_POOL_MIN_SIZE', 2),
+            'max_size': env_int('DB_POOL_MAX_SIZE', 10),
+            'timeout': env_int('DB_POOL_TIMEOUT', 10),
+            'max_idle': env_int('DB_POOL_MAX_IDLE', 300),
+            #checks a connection when it is handed out by the pool, same idea as CONN_HEALTH_CHECKS
+            'check': ConnectionPool.check_connection,
+        }
+
+    if env('DB_REPLICA_NAME') or env('DB_REPLICA_HOST'):
+        #Optional read replica. Same engine and credentials as the primary unless overridden.
+        #Locally two SQLite files can stand in for the primary and the replica:
+        #   DB_NAME=primary.sqlite3 DB_REPLICA_NAME=replica.sqlite3
+        databases['replica'] = {
+            **databases['default'],
+            'NAME':
+            env('DB_REPLICA_NAME', databases['default']['NAME']),
+            'HOST':
+            env('DB_REPLICA_HOST', databases['default']['HOST']),
+            'PORT':
+            env('DB_REPLICA_PORT', databases['default']['PORT']),
+            'OPTIONS':
+            dict(databases['default']['OPTIONS']),
+            #during tests the replica is the same database as the primary
+            'TEST': {
+                'MIRROR': 'default'
+            },
+        }
+    return databases
+
+
+DATABASES = database_settings(DEBUG)
+
+DATABASE_ROUTERS = ['api.routers.PrimaryReplicaRouter']
+
+#After a user writes, their reads stay on the primary for this many seconds
+#so they never read a replica that has not caught up yet (read-your-writes).
+REPLICA_PIN_SECONDS = env_int('REPLICA_PIN_SECONDS', 5)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -129,27 +252,110 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS':
     'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE':
-    5
+    5,
+    #token buckets, see api/throttling.py
+    'DEFAULT_THROTTLE_RATES': {
+        'products': env('THROTTLE_RATE_PRODUCTS', '120/min'),
+        'order_create': env('THROTTLE_RATE_ORDER_CREATE', '10/min'),
+    },
 }
+#the throttles run their Lua script on this cache's Redis server
+THROTTLE_CACHE_ALIAS = 'shared'
 SPECTACULAR_SETTINGS = {
     'TITLE': 'E-commerce API',
     'DESCRIPTION': 'An API for an online store',
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
+    #the order status choices keep their name next to the bulk-status subset
+    'ENUM_NAME_OVERRIDES': {
+        'StatusEnum': 'api.models.Order.StatusChoices',
+    },
 }
+#/api/schema/ serves this file (regenerate it with `python manage.py spectacular --file schema.yml`),
+#with the setting off the schema is generated from the code once per process, see api/schema.py
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'schema.yml'
+OPENAPI_SCHEMA_PRECOMPUTED = env_bool('OPENAPI_SCHEMA_PRECOMPUTED', not DEBUG)
 
 CACHES = {
+    #per-process LRU in front of Redis, see api/cache_backends.py
     "default": {
+        "BACKEND": "api.cache_backends.TieredCache",
+        "LOCATION": "tiered",
+        "OPTIONS": {
+            "SHARED_ALIAS": "shared",
+            "LOCAL_MAX_ENTRIES": env_int("CACHE_LOCAL_MAX_ENTRIES", 1000),
+            "LOCAL_TIMEOUT": env_int("CACHE_LOCAL_TIMEOUT", 5),
+        }
+    },
+    "shared": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/1",  # ✅ corrected
+        "LOCATION": env("REDIS_URL", "redis://127.0.0.1:6379/1"),
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
             # "PASSWORD": "your_redis_password_if_any",
         }
-    }
+    },
 }
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
+
+#Background tasks (api/taskqueue.py), run with `python manage.py run_worker`.
+#Eager mode runs them right after the request's transaction commits, handy without a worker.
+TASK_QUEUE_EAGER = env_bool('TASK_QUEUE_EAGER', False)
+TASK_QUEUE_BASE_BACKOFF = 2
+TASK_QUEUE_MAX_BACKOFF = 300
+
+#server-sent events on /push/, see api/push.py
+#with a Redis URL the events reach the subscribers of every process, not just the publishing one
+PUSH_REDIS_URL = env('PUSH_REDIS_URL', '')
+PUSH_HEARTBEAT_SECONDS = 15
+PUSH_QUEUE_SIZE = 100
+PUSH_MAX_TOPICS = 100
+
+#/products/changes, see api/changefeed.py
+PRODUCT_CHANGES_PAGE_SIZE = 100
+PRODUCT_CHANGES_MAX_PAGE_SIZE = 1000
+PRODUCT_CHANGES_SETTLE_SECONDS = env_int('PRODUCT_CHANGES_SETTLE_SECONDS', 2)
+
+#`manage.py archive_orders` moves Confirmed/Canceled orders older than this out of the live tables
+ORDER_ARCHIVE_AFTER_DAYS = env_int('ORDER_ARCHIVE_AFTER_DAYS', 90)
+ORDER_ARCHIVE_BATCH_SIZE = 1000
+
+#`manage.py warm_cache` (api/warmup.py): the product list queries that are always warmed,
+#plus the most requested ones, and the order lists of users who ordered recently
+WARM_CACHE_PRODUCT_PATHS = ['/products/']
+WARM_CACHE_TOP_PRODUCT_QUERIES = 50
+WARM_CACHE_ACTIVE_DAYS = 30
+WARM_CACHE_ACTIVE_USERS = 500
+WARM_CACHE_CONCURRENCY = env_int('WARM_CACHE_CONCURRENCY', 4)
+#share of product list requests counted for the popularity ranking
+WARM_CACHE_RECORD_RATE = 0.01
+WARM_CACHE_TRACKED_PATHS = 200
+#warm in the background when a web worker starts, once per deploy (lock timeout in seconds)
+WARM_CACHE_ON_STARTUP = env_bool('WARM_CACHE_ON_STARTUP', False)
+WARM_CACHE_STARTUP_LOCK = 300
+
+#POST /orders/bulk-status/, see api/transitions.py
+ORDER_BULK_STATUS_CHUNK_SIZE = 500
+ORDER_BULK_STATUS_MAX_IDS = 10000
+
+EMAIL_BACKEND = env('EMAIL_BACKEND',
+                    'django.core.mail.backends.console.EmailBackend')
+
+#Idempotency-Key support on POST /orders/ (api/idempotency.py)
+IDEMPOTENCY_KEY_TTL = env_int('IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+IDEMPOTENCY_WAIT = 5
+
+#N+1 detection and per-view query budgets (api/querybudget.py).
+#Warns while developing, fails the request when strict, removed from the stack when disabled.
+#The test runner (drf_course/test_runner.py) turns on both.
+QUERY_INSPECTOR_ENABLED = env_bool('QUERY_INSPECTOR', DEBUG)
+QUERY_BUDGET_STRICT = env_bool('QUERY_BUDGET_STRICT', False)
+QUERY_INSPECTOR_NPLUSONE_THRESHOLD = 3
+
+#responses smaller than this many bytes are not compressed, see api/compression.py
+COMPRESSION_MIN_SIZE = env_int('COMPRESSION_MIN_SIZE', 1024)
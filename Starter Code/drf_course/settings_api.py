@@ -0,0 +1,63 @@
+"""
+Settings for API worker processes (JWT clients only).
+
+    DJANGO_SETTINGS_MODULE=drf_course.settings_api gunicorn -c drf_course/gunicorn_api.py
+
+Same as drf_course/settings.py minus everything only a developer or the admin site needs:
+django_extensions, silk, drf_spectacular, admin, messages, sessions and their middleware.
+Fewer apps means fewer modules imported at boot and less memory per worker.
+/api/schema/ stays: it serves the precomputed schema.yml, which needs no drf_spectacular.
+Compare both profiles with `python manage.py bench_startup`.
+"""
+from drf_course.settings import *  # noqa: F401,F403
+
+DEBUG = env_bool('DJANGO_DEBUG', False)
+#settings.py derived these from its own DEBUG default (on), derive them again for this one
+DATABASES = database_settings(DEBUG)
+OPENAPI_SCHEMA_PRECOMPUTED = env_bool('OPENAPI_SCHEMA_PRECOMPUTED', not DEBUG)
+
+DEV_ONLY_APPS = {
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'django_extensions',
+    'silk',
+    'drf_spectacular',
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEV_ONLY_APPS]
+
+#sessions, CSRF and messages only matter for browser logins, the API authenticates every request with a JWT
+DEV_ONLY_MIDDLEWARE = {
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'silk.middleware.SilkyMiddleware',
+    'api.querybudget.QueryInspectorMiddleware',
+}
+MIDDLEWARE = [m for m in MIDDLEWARE if m not in DEV_ONLY_MIDDLEWARE]
+
+#copied, not modified in place: the dicts are shared with drf_course.settings
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'OPTIONS': {
+        'context_processors': ['django.template.context_processors.request'],
+    },
+}]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ],
+    #no browsable API: it pulls in the template engine and the forms machinery
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+}
+#the schema generator is only imported by the dev profile (see drf_course/urls.py)
+REST_FRAMEWORK.pop('DEFAULT_SCHEMA_CLASS', None)
+
+QUERY_INSPECTOR_ENABLED = False
+QUERY_BUDGET_STRICT = False
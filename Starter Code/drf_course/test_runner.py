@@ -0,0 +1,14 @@
+"""
+`manage.py test` runs with the query inspector on and strict (see api/querybudget.py):
+an N+1 query or a view over its query budget fails the test instead of logging a warning.
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_INSPECTOR_ENABLED = True
+        settings.QUERY_BUDGET_STRICT = True
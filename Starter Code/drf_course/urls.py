@@ -1,30 +1,46 @@
-from django.contrib import admin
+from django.apps import apps
 from django.urls import include, path
+from api.schema import schema_view
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
-from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     ###
     path('', include('api.urls')),
     ###
-    path('silk/', include('silk.urls', namespace='silk')),
-    ###
     path('api/token/', TokenObtainPairView.as_view(),
          name='token_obtain_pair'),
     #this returns access and refresh tokens upon valid user authentication
     path('api/token/refresh/',
          TokenRefreshView.as_view(),
          name='token_refresh'),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    # Optional UI:
-    path('api/schema/swagger-ui/',
-         SpectacularSwaggerView.as_view(url_name='schema'),
-         name='swagger-ui'),
-    path('api/schema/redoc/',
-         SpectacularRedocView.as_view(url_name='schema'),
-         name='redoc'),
 ]
+
+#admin, silk and the schema UIs only exist in the development profile,
+#API workers (drf_course/settings_api.py) never import them
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
+
+if apps.is_installed('silk'):
+    urlpatterns.append(path('silk/', include('silk.urls', namespace='silk')))
+
+#precomputed and served from memory (see api/schema.py), in both profiles:
+#reading schema.yml needs no drf_spectacular at runtime
+urlpatterns.append(path('api/schema/', schema_view, name='schema'))
+
+if apps.is_installed('drf_spectacular'):
+    from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
+
+    urlpatterns += [
+        # Optional UI:
+        path('api/schema/swagger-ui/',
+             SpectacularSwaggerView.as_view(url_name='schema'),
+             name='swagger-ui'),
+        path('api/schema/redoc/',
+             SpectacularRedocView.as_view(url_name='schema'),
+             name='redoc'),
+    ]
@@ -10,7 +10,12 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_course.settings')
 
 application = get_wsgi_application()
+
+#import the URLconf, and with it every view and serializer, now instead of on the first request;
+#with gunicorn's preload_app (drf_course/gunicorn_api.py) this happens once, before the workers fork
+get_resolver().url_patterns